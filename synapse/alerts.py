@@ -1,13 +1,9 @@
 import os
 
-from io import StringIO
-from ConfigParser import RawConfigParser
-
-from synapse.syncmd import exec_cmd
 from synapse.config import config
+from synapse.config_watcher import ConfigWatcher
 from synapse.logger import logger
-from synapse.scheduler import SynSched
-from synapse.resources.resources import ResourcesController
+from synapse.synapse_exceptions import ResourceException
 from synapse.task import OutgoingMessage, AmqpTask
 from synapse import compare
 
@@ -16,17 +12,25 @@ from synapse import compare
 class AlertsController(object):
     def __init__(self, locator, scheduler, publish_queue):
         self.path = self._configure()
-        self.plugins = {}
+        self.configs = ConfigWatcher(self.path)
+        self.plugins = []
         self._load_configs()
         self.publish_queue = publish_queue
         self.locator = locator
         self.scheduler = scheduler
+        self.reload_job = None
+
+        # Each sensor is sampled once per interval for all its thresholds:
+        # (resource, sensor, interval) -> (job id, set of thresholds)
+        self.jobs = {}
 
-        self.alerts = []
+        # Raised alerts, indexed by
+        # (resource, sensor, compare, threshold, window)
+        self.alerts = {}
 
     def start(self):
         self._add_alerts()
-        self.scheduler.add_job(self._reload, 30)
+        self.reload_job = self.scheduler.add_job(self._reload, 30, delay=30)
 
     def _configure(self):
         config_path = os.path.join(config.paths['config_path'], 'alerts.d')
@@ -35,50 +39,108 @@ class AlertsController(object):
         return config_path
 
     def _reload(self):
-        self._load_configs()
-        self._add_alerts()
+        if self._load_configs():
+            self._add_alerts()
 
     def _load_configs(self):
-        for conf_file in os.listdir(self.path):
-            if not conf_file.endswith('.conf'):
-                continue
-            full_path = os.path.join(self.path, conf_file)
-            conf = RawConfigParser()
-            conf.read(full_path)
-            for section in conf.sections():
-                if not section in self.plugins:
-                    self.plugins[section] = []
-                items = dict(conf.items(section))
-                for key, value in items.iteritems():
-                    task = {'method': key,
-                            'value': value,
-                            'scheduled': False}
-                    self.plugins[section].append(task)
+        """Returns True if the alerts definitions changed."""
+        if not self.configs.load():
+            return False
+        plugins = self.configs.definitions()
+        changed = plugins != self.plugins
+        self.plugins = plugins
+        return changed
+
+    def _get_samplers(self):
+        """Returns the thresholds to check for each sensor and interval.
+        Several files can define thresholds for the same sensor."""
+        samplers = {}
+        for conf_file, resource, tasks in self.plugins:
+            for method, value in tasks.iteritems():
+                parsed_params = self._parse_parameters(value)
+                try:
+                    interval = int(parsed_params[0])
+                    # Optional window in seconds: the average of the sensor
+                    # over that period is compared instead of its value.
+                    window = int(parsed_params[3] or 0) or None
+                except ValueError as err:
+                    self.logger.warning("Invalid alert %s.%s in %s (%s)" %
+                                        (resource, method, conf_file, err))
+                    continue
+                key = (resource, method, interval)
+                thresholds = samplers.setdefault(key, set())
+                compare_method, threshold = parsed_params[1:3]
+                if compare_method is not None and threshold is not None:
+                    thresholds.add((compare_method, threshold, window))
+        return samplers
 
     def _add_alerts(self):
-        for resource, tasks in self.plugins.iteritems():
-            instance = self.locator.get_instance(resource)
-            for task in tasks:
-                if task['scheduled']:
-                    continue
-                method_ref = getattr(instance, task['method'])
-                parsed_params = self._parse_parameters(task['value'])
-                interval = int(parsed_params[0])
-                compare_method = parsed_params[1]
-                threshold = parsed_params[2]
-                actionargs = (method_ref, compare_method, threshold)
-                self.scheduler.update_job(self.alert, int(interval),
-                                          actionargs=actionargs)
-                task['scheduled'] = True
+        samplers = self._get_samplers()
+
+        # Unschedule the sensors without alerts anymore
+        for key, (job_id, thresholds) in self.jobs.items():
+            if key not in samplers:
+                self.scheduler.remove_job(job_id)
+                del self.jobs[key]
+
+        for key, thresholds in samplers.iteritems():
+            if key in self.jobs:
+                # Thresholds are updated in place
+                self.jobs[key] = (self.jobs[key][0], thresholds)
+                continue
+            resource, method, interval = key
+            try:
+                instance = self.locator.get_instance(resource)
+                method_ref = getattr(instance, method)
+            except (ResourceException, AttributeError) as err:
+                self.logger.warning("Invalid alert %s.%s (%s)" %
+                                    (resource, method, err))
+                continue
+            job_id = self.scheduler.add_job(self.sample, interval,
+                                            actionargs=(key, method_ref))
+            self.jobs[key] = (job_id, thresholds)
+
+        # Forget the alerts raised on removed thresholds
+        active = set((resource, method) + threshold
+                     for (resource, method, interval), thresholds
+                     in samplers.iteritems()
+                     for threshold in thresholds)
+        for key in self.alerts.keys():
+            if key not in active:
+                del self.alerts[key]
 
     def _parse_parameters(self, parameters):
-        return parameters.split(',') + [None] * (4 - len(parameters))
-
-    def alert(self, sensor, compare_method, threshold):
-        value = sensor()
-
-        if compare_method is not None and threshold is not None:
-            result = getattr(compare, compare_method)(value, threshold)
+        parameters = parameters.split(',')
+        return parameters + [None] * (4 - len(parameters))
+
+    def sample(self, key, sensor):
+        """Reads the sensor once and checks all its thresholds."""
+        entry = self.jobs.get(key)
+        if entry is None:
+            return
+
+        values = {}
+        for compare_method, threshold, window in entry[1]:
+            try:
+                if window not in values:
+                    values[window] = (sensor(window=window) if window
+                                      else sensor())
+                # No value yet, e.g. no history right after startup
+                if values[window] is None:
+                    continue
+                self.alert(sensor, compare_method, threshold,
+                           values[window], window)
+            except Exception as err:
+                self.logger.error("Could not check %s %s %s (%s)" %
+                                  (sensor.__name__, compare_method,
+                                   threshold, err))
+
+    def alert(self, sensor, compare_method, threshold, value, window=None):
+        result = getattr(compare, compare_method)(value, threshold)
+        key = (sensor.__self__.__class__.__resource__, sensor.__name__,
+               compare_method, threshold, window)
+
+        if result and key not in self.alerts:
             alert = {
                 'property': sensor.__name__,
                 'output': value,
@@ -86,15 +148,16 @@ class AlertsController(object):
                 'threshold': threshold,
                 'compare_method': compare_method,
             }
+            if window:
+                alert['window'] = window
+            self.alerts[key] = alert
+            self._publish(sensor, alert)
 
-            if result and not self._alert_sent(alert):
-                self._add_alert(alert)
-                self._publish(sensor, alert)
-
-            elif not result and self._alert_sent(alert):
-                self._remove_alert(alert)
-                alert['level'] = 'normal'
-                self._publish(sensor, alert)
+        elif not result and key in self.alerts:
+            alert = self.alerts.pop(key)
+            alert['output'] = value
+            alert['level'] = 'normal'
+            self._publish(sensor, alert)
 
     def _publish(self, sensor, alert):
         msg = {
@@ -105,22 +168,9 @@ class AlertsController(object):
 
         self.publish_queue.put(AmqpTask(OutgoingMessage(**msg)))
 
-    def _alert_sent(self, alert):
-        for al in self.alerts:
-            if alert['property'] == al['property']:
-                return True
-        return False
-
-    def _add_alert(self, alert):
-        self.alerts.append(alert)
-
-    def _remove_alert(self, alert):
-        for al in self.alerts:
-            if alert['property'] == al['property']:
-                self.alerts.remove(al)
-
     def close(self):
-        super(AlertsController, self).close()
-        self.logger.debug("Shutting down alerts scheduler")
-        self.scheduler.shutdown()
-
+        self.logger.debug("Removing alerts jobs")
+        if self.reload_job is not None:
+            self.scheduler.remove_job(self.reload_job)
+        for job_id, thresholds in self.jobs.itervalues():
+            self.scheduler.remove_job(job_id)
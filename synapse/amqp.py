@@ -1,19 +1,68 @@
+import os
 import time
 import pika
+import pickle
 import socket
+import tempfile
 
 from Queue import Empty
 from ssl import CERT_REQUIRED
 from datetime import datetime, timedelta
 
 from pika.adapters import SelectConnection
-from pika.adapters.select_connection import SelectPoller
+from pika.adapters.select_connection import SelectPoller, READ
 from pika.credentials import PlainCredentials, ExternalCredentials
 
+from synapse.config import config
+from synapse.facts import get_facts
 from synapse.logger import logger
 from synapse.task import IncomingMessage, AmqpTask
 
 
+# Seconds between two checks of the host facts bound to the filter exchange
+BINDINGS_CHECK_DELAY = 10
+
+
+def get_binding_keys(uuid, facts):
+    """Returns the routing keys of the messages targeting this host on the
+    filter exchange. Messages routed with 'all' reach every host.
+    """
+    keys = set(['all',
+                'uuid.%s' % uuid,
+                'hostname.%s' % facts['hostname'],
+                'platform.%s' % facts['platform']])
+    # Loopback addresses are shared by every host
+    keys.update('ip.%s' % ip for ip in facts['ips'].itervalues()
+                if not ip.startswith('127.'))
+    keys.update('mac.%s' % mac for mac in facts['macs'].itervalues()
+                if mac != '00:00:00:00:00:00')
+    return keys
+
+
+def _add_poller_handler(poller, fileno, handler):
+    """Watches fileno for reading in a pika 0.9 poller, which only knows
+    about the connection socket. handler is called like the connection
+    events handler. Only the poll based pollers (the Linux default) can
+    watch more than one file descriptor, returns False with the others.
+    """
+    if not hasattr(poller, '_poll'):
+        return False
+
+    poller._poll.register(fileno, READ)
+    connection_handler = poller._handler
+
+    def _handle_events(fd, events, *args, **kwargs):
+        if fd != fileno:
+            connection_handler(fd, events, *args, **kwargs)
+        # Connection writes poll in write only mode, publishing from there
+        # would reenter the publisher.
+        elif not kwargs.get('write_only'):
+            handler(fd, events)
+
+    poller._handler = _handle_events
+    return True
+
+
 @logger
 class Amqp(object):
     def __init__(self, conf):
@@ -53,6 +102,9 @@ class Amqp(object):
 
         self._processing = False
 
+        # Number of unacknowledged messages the broker may deliver to us
+        self.prefetch_count = 1
+
         # Plain credentials
         credentials = PlainCredentials(self.username, self.password)
         pika_options = {'host': self.host,
@@ -164,7 +216,7 @@ class Amqp(object):
         self._connection.channel(self.on_consume_channel_open)
 
     def on_consume_channel_open(self, channel):
-        channel.basic_qos(prefetch_count=1)
+        channel.basic_qos(prefetch_count=self.prefetch_count)
         self._consume_channel_number = channel.channel_number
         self.logger.debug("Consume channel #%d successfully opened." %
                           channel.channel_number)
@@ -231,19 +283,108 @@ class Amqp(object):
             self._consume_channel.close()
 
 class AmqpSynapse(Amqp):
-    def __init__(self, conf, pq, tq):
+    def __init__(self, conf, pq, tq, prefetch_count=1):
         super(AmqpSynapse, self).__init__(conf)
         self.pq = pq
         self.tq = tq
+        self.prefetch_count = prefetch_count
+
+        # Ioloop or poller in which the publish queue wakeup pipe is
+        # registered
+        self._wakeup_target = None
+        self._polling = False
+        self._redeliveries_timeout = None
+
+        # Topic exchange on which targeted messages are routed according to
+        # the host facts, see get_binding_keys
+        self.filter_exchange = conf['filter_exchange']
+        self._bindings = set()
+        self._bindings_connection = None
 
     ##########################
     # Consuming
     ##########################
     def setup_consume_channel(self):
         self.add_on_cancel_callback()
+        if self.filter_exchange:
+            self._consume_channel.exchange_declare(
+                self.on_filter_exchange_declareok,
+                exchange=self.filter_exchange, type='topic', durable=True)
         self._consumer_tag = self._consume_channel.basic_consume(
             self._on_message, self.queue)
 
+    def on_filter_exchange_declareok(self, method_frame):
+        # Keys bound by a previous run are unbound if the facts changed since
+        self._bindings = self._load_bindings()
+        self._update_bindings()
+
+        # Facts are checked from the ioloop, as pika channels aren't thread
+        # safe. Only one check is pending per connection.
+        if self._bindings_connection is not self._connection:
+            self._bindings_connection = self._connection
+            self._connection.add_timeout(BINDINGS_CHECK_DELAY,
+                                         self._check_bindings)
+
+    def _check_bindings(self):
+        if self._bindings_connection is not self._connection:
+            return
+        self._update_bindings()
+        self._connection.add_timeout(BINDINGS_CHECK_DELAY,
+                                     self._check_bindings)
+
+    def _update_bindings(self):
+        """Binds the queue to the filter exchange with the routing keys of
+        the current host facts and unbinds the outdated ones."""
+        if not (self._consume_channel and self._consume_channel._state == 2):
+            return
+        keys = get_binding_keys(self.queue, get_facts().get())
+        if keys == self._bindings:
+            return
+        for key in keys - self._bindings:
+            self.logger.debug("[AMQP] Binding to %s with %s" %
+                              (self.filter_exchange, key))
+            self._consume_channel.queue_bind(None, queue=self.queue,
+                                             exchange=self.filter_exchange,
+                                             routing_key=key)
+        for key in self._bindings - keys:
+            self.logger.debug("[AMQP] Unbinding from %s with %s" %
+                              (self.filter_exchange, key))
+            self._consume_channel.queue_unbind(None, queue=self.queue,
+                                               exchange=self.filter_exchange,
+                                               routing_key=key)
+        self._bindings = keys
+        self._save_bindings()
+
+    def _get_bindings_path(self):
+        return os.path.join(config.controller['persistence_path'],
+                            'filter_bindings.pkl')
+
+    def _load_bindings(self):
+        """Returns the keys last bound to the filter exchange, by this run or
+        a previous one."""
+        try:
+            with open(self._get_bindings_path(), 'rb') as fd:
+                exchange, keys = pickle.load(fd)
+        except (IOError, EOFError, ValueError, pickle.PickleError) as err:
+            self.logger.debug("No filter bindings loaded (%s)" % err)
+            return set()
+        # Bindings of another exchange are left alone, it may not exist
+        if exchange != self.filter_exchange:
+            return set()
+        return set(keys)
+
+    def _save_bindings(self):
+        path = self._get_bindings_path()
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                            prefix='filter_bindings')
+            with os.fdopen(fd, 'wb') as tmp:
+                pickle.dump((self.filter_exchange, sorted(self._bindings)),
+                            tmp)
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as err:
+            self.logger.error("Can't save filter bindings (%s)" % err)
+
     def add_on_cancel_callback(self):
         self._consume_channel.add_on_cancel_callback(
             self.on_consumer_cancelled)
@@ -275,7 +416,7 @@ class AmqpSynapse(Amqp):
         self.logger.debug("[AMQP-RECEIVE] #%s: %s" %
                           (method_frame.delivery_tag, body))
         try:
-            message = IncomingMessage(body)
+            message = IncomingMessage(body, header_frame.content_type)
             headers = vars(header_frame)
             headers.update(vars(method_frame))
             task = AmqpTask(message, headers=headers)
@@ -299,8 +440,47 @@ class AmqpSynapse(Amqp):
         self._publish_channel.confirm_delivery(
             callback=self.on_confirm_delivery)
         if self._connection:
-            self._connection.add_timeout(.1, self._publisher)
-            self._connection.add_timeout(1, self._check_redeliveries)
+            self._redeliveries_timeout = None
+            if self._deliveries:
+                self._schedule_redeliveries_check(self.redelivery_timeout)
+
+            # Publish responses as soon as the controller enqueues them. Fall
+            # back on checking the queue at regular interval if the ioloop
+            # can't be woken up.
+            if not self._add_wakeup_handler() and not self._polling:
+                self._polling = True
+                self._connection.add_timeout(.1, self._publisher)
+
+            # Flush what has been enqueued while we were disconnected
+            self._publisher()
+
+    def _add_wakeup_handler(self):
+        """Registers the publish queue wakeup pipe in the connection ioloop.
+        Returns False if the ioloop can only watch the connection socket.
+        """
+        wakeup = getattr(self.pq, 'wakeup', None)
+        ioloop = self._connection.ioloop
+        if wakeup is None:
+            return False
+
+        # pika 0.9 ioloops have no add_handler and their poller is replaced
+        # on each connection, the pipe is registered in the poller itself.
+        target = ioloop if hasattr(ioloop, 'add_handler') else ioloop.poller
+        if target is self._wakeup_target:
+            return True
+
+        def _handle_wakeup(fileno, events, *args, **kwargs):
+            self._publisher()
+
+        if target is ioloop:
+            ioloop.add_handler(wakeup.fileno(), _handle_wakeup, READ)
+        elif not _add_poller_handler(target, wakeup.fileno(),
+                                     _handle_wakeup):
+            return False
+
+        self._wakeup_target = target
+        self.logger.debug("Publisher waiting for publish queue events.")
+        return True
 
     def on_confirm_delivery(self, tag):
         self.logger.debug("[AMQP-DELIVERED] #%s" % tag.method.delivery_tag)
@@ -308,39 +488,68 @@ class AmqpSynapse(Amqp):
             del self._deliveries[tag.method.delivery_tag]
 
     def _publisher(self):
-        """This callback is used to check at regular interval if there's any
-        message to be published to RabbitMQ.
+        """This callback is called when messages have been put in the publish
+        queue. It publishes all of them to RabbitMQ.
         """
+        wakeup = getattr(self.pq, 'wakeup', None)
+        if wakeup is not None:
+            wakeup.clear()
+
+        # Keep the messages in the queue until the channel is (re)opened
+        if not (self._publish_channel and self._publish_channel._state == 2):
+            return
+
         try:
-            for i in range(10):
+            while True:
                 pt = self.pq.get(False)
                 self._handle_publish(pt)
         except Empty:
             pass
 
-        if self._connection:
+        if self._polling and self._connection:
             self._connection.add_timeout(.1, self._publisher)
 
+    def _schedule_redeliveries_check(self, delay):
+        if self._redeliveries_timeout is None and self._connection:
+            self._redeliveries_timeout = self._connection.add_timeout(
+                delay, self._check_redeliveries)
+
     def _check_redeliveries(self):
         # In case we have a message to redeliver, let's wait a few seconds
         # before we actually redeliver them. This is to avoid unwanted
         # redeliveries.
+        self._redeliveries_timeout = None
+        timeout = timedelta(seconds=self.redelivery_timeout)
+        now = datetime.now()
+        next_check = None
         for key, value in self._deliveries.items():
-            delta = datetime.now() - value['ts']
+            delta = now - value['ts']
             task = value['task']
-            if delta > timedelta(seconds=self.redelivery_timeout):
+            if delta > timeout:
                 self.logger.debug("[AMQP-REPLUBLISHED] #%s: %s" %
                                   (key, task.body))
                 self.pq.put(task)
                 del self._deliveries[key]
-        if self._connection:
-            self._connection.add_timeout(.1, self._check_redeliveries)
+            else:
+                remaining = timeout - delta
+                if next_check is None or remaining < next_check:
+                    next_check = remaining
+
+        # Only check again when the oldest unconfirmed delivery expires
+        if next_check is not None:
+            self._schedule_redeliveries_check(
+                max(next_check.total_seconds(), .1))
 
     def _handle_publish(self, message):
         """This method actually publishes the item to the broker after
         sanitizing it from unwanted informations.
         """
-        publish_args = message.get()
+        try:
+            publish_args = message.get()
+        except ValueError as err:
+            self.logger.error("Can't publish <%s> (%s)" %
+                              (message.correlation_id, err))
+            publish_args = None
 
         if (self._consume_channel and self._consume_channel._state == 2):
             delivery_tag = message.delivery_tag
@@ -349,17 +558,23 @@ class AmqpSynapse(Amqp):
                 index = self._responses.index(delivery_tag)
                 del self._responses[index]
 
+        if publish_args is None:
+            if message.correlation_id is not None:
+                self._processing = False
+            return
+
         if (self._publish_channel and self._publish_channel._state == 2):
             self._publish_channel.basic_publish(**publish_args)
 
             self._message_number += 1
             self.logger.debug("[AMQP-PUBLISHED] #%s: <%s> %s" %
                              (self._message_number, message.correlation_id,
-                              message.body))
+                              publish_args['body']))
         if message.redeliver:
             self._deliveries[self._message_number] = {}
             self._deliveries[self._message_number]["task"] = message
             self._deliveries[self._message_number]["ts"] = datetime.now()
+            self._schedule_redeliveries_check(self.redelivery_timeout)
 
         if publish_args['properties'].correlation_id is not None:
             self._processing = False
@@ -0,0 +1,88 @@
+import json
+
+try:
+    import simplejson
+    if simplejson.encoder.c_make_encoder is None:
+        raise ImportError("simplejson speedups are not available")
+except ImportError:
+    simplejson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+JSON = 'application/json'
+MSGPACK = 'application/x-msgpack'
+
+
+# Messages are encoded with the fastest library available: simplejson when
+# its C speedups are built, then ujson, then the standard json module.
+if simplejson is not None:
+    name = 'simplejson'
+    _dumps = simplejson.dumps
+    _loads = simplejson.loads
+elif ujson is not None:
+    name = 'ujson'
+    _dumps = ujson.dumps
+    _loads = ujson.loads
+else:
+    name = 'json'
+    _dumps = json.dumps
+    _loads = json.loads
+
+# Content type -> (encoder, decoder)
+codecs = {JSON: (_dumps, _loads)}
+
+# msgpack >= 0.5.2 is required for the raw argument of unpackb. Python 2
+# str are packed as msgpack str, not bin, so that peers get text keys and
+# values like in JSON.
+if msgpack is not None:
+    codecs[MSGPACK] = (lambda obj: msgpack.packb(obj, use_bin_type=False),
+                       lambda data: msgpack.unpackb(data, raw=False))
+    codecs['application/msgpack'] = codecs[MSGPACK]
+
+
+def _get_mime_type(content_type):
+    # Drop parameters such as "; charset=utf-8"
+    return (content_type or '').split(';')[0].strip().lower()
+
+
+def is_supported(content_type):
+    return _get_mime_type(content_type) in codecs
+
+
+def _get_codec(content_type):
+    try:
+        return codecs[_get_mime_type(content_type)]
+    except KeyError:
+        raise ValueError("Unsupported content type: %s" % content_type)
+
+
+def encode(obj, content_type=JSON):
+    """Returns obj encoded in the given content type. Raises ValueError if
+    it can't be encoded."""
+    dumps = _get_codec(content_type)[0]
+    try:
+        return dumps(obj)
+    except (TypeError, OverflowError) as err:
+        raise ValueError("Can't encode message: %s" % err)
+
+
+def decode(data, content_type=JSON):
+    """Returns the object encoded in data. Messages without content type, or
+    with an unknown one, are JSON. Raises ValueError if data is not valid."""
+    loads = codecs.get(_get_mime_type(content_type), codecs[JSON])[1]
+    try:
+        return loads(data)
+    except ValueError:
+        raise
+    except Exception as err:
+        # Decoders raise their own exception types
+        raise ValueError("Can't decode message: %s" % err)
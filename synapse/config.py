@@ -59,12 +59,16 @@ class Config(object):
         self.compliance = self.set_compliance_config()
         self.resourcefile = self.set_resourcefile_config()
         self.controller = self.set_controller_config()
+        self.packages = self.set_packages_config()
+        self.nagios = self.set_nagios_config()
         self.log = self.set_logger_config()
 
         self.sections = [('rabbitmq', self.rabbitmq),
                          ('monitor', self.monitor),
                          ('resourcefile', self.resourcefile),
                          ('controller', self.controller),
+                         ('packages', self.packages),
+                         ('nagios', self.nagios),
                          ('log', self.log)]
 
     def add_section(self, name, section):
@@ -88,6 +92,8 @@ class Config(object):
             'password': 'guest',
             'uuid': '',
             'exchange': 'amq.fanout',
+            'filter_exchange': '',
+            'content_type': 'application/json',
             'publish_exchange': 'inbox',
             'publish_routing_key': '',
             'status_exchange': 'inbox',
@@ -126,6 +132,8 @@ class Config(object):
             'enable_monitoring': True,
             'default_interval': '30',
             'publish_status': False,
+            'inotify': False,
+            'rescan_interval': '3600',
         }
 
         conf.update(self.conf.get('monitor', {}))
@@ -133,6 +141,8 @@ class Config(object):
         conf['default_interval'] = self.sanitize_int(conf['default_interval'])
         conf['publish_status'] = self.sanitize_true_false(
             conf['publish_status'])
+        conf['inotify'] = self.sanitize_true_false(conf['inotify'])
+        conf['rescan_interval'] = self.sanitize_int(conf['rescan_interval'])
 
         return conf
 
@@ -142,6 +152,7 @@ class Config(object):
             'enable_compliance': True,
             'default_interval': '30',
             'alert_interval': '3600',
+            'hash_algorithm': 'md5',
         }
 
         conf.update(self.conf.get('compliance', {}))
@@ -173,12 +184,43 @@ class Config(object):
             'permissions_path': self.paths['permissions'],
             'distribution_name': self.get_platform()[0],
             'distribution_version': self.get_platform()[1],
+            'workers': '4',
+            'facts_interval': '300',
             }
 
         #TODO check for mandatory config files like permissions
 
         conf.update(self.conf.get('controller', {}))
 
+        conf['workers'] = max(1, self.sanitize_int(conf['workers']))
+        conf['facts_interval'] = self.sanitize_int(conf['facts_interval'])
+
+        return conf
+
+    def set_packages_config(self):
+        conf = {
+            'batch_window': '0.5',
+            'index_ttl': '3600',
+        }
+
+        conf.update(self.conf.get('packages', {}))
+
+        conf['batch_window'] = self.sanitize_float(conf['batch_window'])
+        conf['index_ttl'] = self.sanitize_int(conf['index_ttl'])
+
+        return conf
+
+    def set_nagios_config(self):
+        conf = {
+            'max_checks': '4',
+            'check_timeout': '60',
+        }
+
+        conf.update(self.conf.get('nagios', {}))
+
+        conf['max_checks'] = max(1, self.sanitize_int(conf['max_checks']))
+        conf['check_timeout'] = self.sanitize_int(conf['check_timeout'])
+
         return conf
 
     def set_logger_config(self):
@@ -232,6 +274,12 @@ class Config(object):
         except ValueError:
             raise Exception("'%s' must be an integer" % option)
 
+    def sanitize_float(self, option):
+        try:
+            return float(option)
+        except ValueError:
+            raise Exception("'%s' must be a number" % option)
+
     def dump_config_file(self, to_file=True, *args):
         filecontent = ''
 
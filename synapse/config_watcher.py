@@ -0,0 +1,74 @@
+import os
+
+from ConfigParser import RawConfigParser, Error as ConfigParserError
+
+from synapse.logger import logger
+
+
+@logger
+class ConfigWatcher(object):
+    """Sections of the configuration files of a directory, such as
+    alerts.d or nagios.d. A file is only parsed again when its modification
+    time or size changes.
+    """
+
+    def __init__(self, path, suffix='.conf'):
+        self.path = path
+        self.suffix = suffix
+
+        # file name -> (stat key, {section: {option: value}})
+        self._files = {}
+
+    def load(self):
+        """Returns True if a file was added, removed or modified since the
+        last call."""
+        try:
+            names = sorted(name for name in os.listdir(self.path)
+                           if name.endswith(self.suffix))
+        except OSError as err:
+            self.logger.error("Can't list %s (%s)" % (self.path, err))
+            names = []
+
+        changed = False
+        for name in set(self._files) - set(names):
+            del self._files[name]
+            changed = True
+
+        for name in names:
+            full_path = os.path.join(self.path, name)
+            try:
+                si = os.stat(full_path)
+            except OSError:
+                continue
+            key = (si.st_ino, si.st_size, si.st_mtime)
+            if name in self._files and self._files[name][0] == key:
+                continue
+            self._files[name] = (key, self._parse(full_path))
+            changed = True
+
+        return changed
+
+    def _parse(self, path):
+        conf = RawConfigParser()
+        try:
+            conf.read(path)
+        except ConfigParserError as err:
+            self.logger.warning("Error when parsing %s (%s)" % (path, err))
+        return dict((section, dict(conf.items(section)))
+                    for section in conf.sections())
+
+    @property
+    def sections(self):
+        """Options of each section, merged across files in name order."""
+        sections = {}
+        for name in sorted(self._files):
+            for section, items in self._files[name][1].iteritems():
+                sections.setdefault(section, {}).update(items)
+        return sections
+
+    def definitions(self):
+        """Returns a (file name, section, options) tuple for each section of
+        each file, in name order."""
+        return [(name, section, items)
+                for name in sorted(self._files)
+                for section, items in sorted(self._files[name][1].items())]
@@ -1,13 +1,18 @@
 import json
 import traceback
 
-from threading import Thread
+from Queue import Queue
+from collections import deque
+from threading import Thread, Lock
 from synapse.synapse_exceptions import ResourceException
 
 from synapse.resource_locator import ResourceLocator
 from synapse.config import config
 from synapse.logger import logger
-from synapse.scheduler import SynSched
+from synapse.scheduler import get_scheduler
+from synapse import inotify
+from synapse.filters import get_filter, load_filters
+from synapse.facts import get_facts
 from synapse.alerts import AlertsController
 from synapse.task import IncomingMessage, OutgoingMessage, AmqpTask
 from synapse import compare
@@ -17,6 +22,10 @@ class Controller(Thread):
     '''The controller is the link between the transport layer and the
     resources layer. Basically, its job is to load resources modules and
     objects and to call their generic "process" method.
+
+    Tasks are processed by a pool of worker threads. Tasks targeting the same
+    resource are never processed concurrently: they wait in a pending queue
+    until the running one is done.
     '''
 
     def __init__(self, tq=None, pq=None):
@@ -27,15 +36,28 @@ class Controller(Thread):
         self.tq = tq
         self.pq = pq
 
-        self.scheduler = SynSched()
+        # Tasks ready to be picked by a worker
+        self.wq = Queue()
+        self.workers = []
+        self.workers_count = config.controller['workers']
+
+        # Tasks waiting for a running task on the same resource to finish,
+        # indexed by (collection, resource id)
+        self._pending = {}
+        self._pending_lock = Lock()
+
+        self.scheduler = get_scheduler()
         self.locator = ResourceLocator(pq)
         self.alerter = AlertsController(self.locator, self.scheduler, pq)
+        self.watcher = None
+        load_filters()
         self.logger.debug("Controller successfully initialized.")
 
     def start_scheduler(self):
         # Start the scheduler thread
         self.scheduler.start()
         self.alerter.start()
+        get_facts().start()
 
         # Prepopulate tasks from config file
         if config.monitor['enable_monitoring']:
@@ -59,12 +81,32 @@ class Controller(Thread):
 
     def _enable_monitoring(self):
         resources = self.locator.get_instance()
+        if config.monitor['inotify']:
+            self._start_watcher(resources.values())
+
         for resource in resources.values():
             if not len(resource.states):
                 continue
             interval = self._get_monitor_interval(resource.__resource__)
+            if resource.watcher:
+                # Changes are watched, only rescan everything once in a while
+                interval = max(interval, config.monitor['rescan_interval'])
             self.scheduler.add_job(resource.monitor_states, interval)
 
+    def _start_watcher(self, resources):
+        if not inotify.is_available():
+            self.logger.warning("Inotify is not available on this system.")
+            return
+
+        self.watcher = inotify.FileWatcher()
+        for resource in resources:
+            if not resource.__watchable__:
+                continue
+            resource.watcher = self.watcher
+            for state in resource.states:
+                self.watcher.watch(resource, state['resource_id'])
+        self.watcher.start()
+
     def _enable_compliance(self):
         resources = self.locator.get_instance()
         for resource in resources.values():
@@ -74,6 +116,12 @@ class Controller(Thread):
             self.scheduler.add_job(resource.check_compliance, interval)
 
     def stop_scheduler(self):
+        # Shutdown the file watcher
+        if self.watcher:
+            self.watcher.shutdown()
+
+        get_facts().stop()
+
         # Shutdown the scheduler/monitor
         self.logger.debug("Shutting down global scheduler...")
         if self.scheduler.isAlive():
@@ -97,33 +145,98 @@ class Controller(Thread):
 
     def run(self):
         """Implementation of the Threading run method. This methods waits on
-        the tasks queue to get messages from the transport layer and then calls
-        the call_method. It then waits for a response to put into the publish
-        queue before waiting for a new task to come.
+        the tasks queue to get messages from the transport layer and hands
+        them over to the workers pool.
         """
 
         self.logger.debug("Controller started.")
+        self._start_workers()
 
-        response = {}
         while True:
             task = self.tq.get()
             if task == "stop":
                 break
+            self._dispatch(task)
+
+        self._stop_workers()
+
+    def _start_workers(self):
+        self.logger.debug("Starting %d workers." % self.workers_count)
+        for index in range(self.workers_count):
+            worker = Thread(target=self._work, name="WORKER-%d" % index)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def _stop_workers(self):
+        for worker in self.workers:
+            self.wq.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+        self.logger.debug("Workers stopped.")
+
+    def _get_task_key(self, task):
+        collection = task.body.get('collection')
+        try:
+            # Some resources can't be modified concurrently at all (e.g.
+            # users and groups databases are locked by system tools).
+            if self.locator.get_instance(collection).__exclusive__:
+                return (collection, None)
+        except ResourceException:
+            pass
+        return (collection, '%s' % task.body.get('id'))
+
+    def _dispatch(self, task):
+        key = self._get_task_key(task)
+        with self._pending_lock:
+            if key in self._pending:
+                self._pending[key].append(task)
+                return
+            self._pending[key] = deque()
+        self.wq.put(task)
+
+    def _release(self, key):
+        with self._pending_lock:
+            waiting = self._pending[key]
+            if waiting:
+                self.wq.put(waiting.popleft())
+            else:
+                del self._pending[key]
+
+    def _work(self):
+        while True:
+            task = self.wq.get()
+            if task is None:
+                break
             try:
-                response = self.call_method(task.sender, task.body)
+                self.process_task(task)
+            except Exception:
+                # Keep the worker alive, the pool wouldn't be refilled
+                self.logger.error('{0}'.format(traceback.format_exc()))
+            finally:
+                self._release(self._get_task_key(task))
 
-            except ResourceException as err:
-                self.logger.error("%s" % err)
+    def process_task(self, task):
+        """Calls the call_method for the given task and puts the response
+        into the publish queue.
+        """
+        response = {}
+        try:
+            response = self.call_method(task.sender, task.body)
 
-                if response.get('status'):
-                    del response['status']
-                response['error'] = '%s' % err
+        except ResourceException as err:
+            self.logger.error("%s" % err)
 
-            except Exception:
-                self.logger.debug('{0}'.format(traceback.format_exc()))
+            if response.get('status'):
+                del response['status']
+            response['error'] = '%s' % err
 
-            finally:
-                self.pq.put(AmqpTask(response, headers=task.headers))
+        except Exception:
+            self.logger.debug('{0}'.format(traceback.format_exc()))
+
+        finally:
+            self.pq.put(AmqpTask(response, headers=task.headers))
 
     def call_method(self, user, body):
         """Reads the collection the message needs to reach and then calls the
@@ -162,18 +275,12 @@ class Controller(Thread):
         match = False
 
         for key, value in filters.iteritems():
-            try:
-                module = 'synapse.filters.%s' % key
-                m = __import__(module)
-                parts = module.split('.')
-                for comp in parts[1:]:
-                    m = getattr(m, comp)
-
-                match = m.check(value)
-                if match == False:
-                    break
-            except ImportError:
-                pass
+            module = get_filter(key)
+            if module is None:
+                continue
+            match = module.check(value)
+            if match == False:
+                break
 
         self.logger.debug("Filters match: %s" % match)
         return match
@@ -12,6 +12,7 @@ from synapse.config import config
 from synapse.controller import Controller
 from synapse.logger import logger
 from synapse.synapse_exceptions import ResourceException
+from synapse.wakeup import WakeupQueue
 
 
 @logger
@@ -36,8 +37,9 @@ class Dispatcher(object):
         self.resourcefile = None
 
         # These queues will be shared between the controller and the
-        # transport and are used for incoming tasks and responses
-        self.pq = Queue()
+        # transport and are used for incoming tasks and responses. Putting
+        # a response in the publish queue wakes up the transport ioloop.
+        self.pq = WakeupQueue()
         self.tq = Queue()
 
     def stop(self, signum, frame):
@@ -86,8 +88,10 @@ class Dispatcher(object):
         """
 
         try:
+            workers = config.controller['workers']
             self.amqpsynapse = AmqpSynapse(config.rabbitmq,
-                                           pq=self.pq, tq=self.tq)
+                                           pq=self.pq, tq=self.tq,
+                                           prefetch_count=workers)
             self.controller = Controller(self.tq, self.pq)
             self.controller.start()
             self.controller.start_scheduler()
@@ -0,0 +1,195 @@
+import socket
+import struct
+import platform
+import threading
+
+from netifaces import interfaces, ifaddresses, AF_INET, AF_LINK
+
+from synapse.config import config
+from synapse.logger import logger
+from synapse.scheduler import get_scheduler
+
+
+# rtnetlink multicast groups of link and address changes
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV6_IFADDR = 0x100
+NETLINK_ROUTE = 0
+
+
+def read_facts():
+    """Returns the identity of this host as matched by message filters."""
+    try:
+        hostname = socket.gethostbyaddr(socket.gethostname())[0]
+    except (IOError, socket.error):
+        hostname = socket.gethostname()
+
+    ips = {}
+    macs = {}
+    for iface in interfaces():
+        addresses = ifaddresses(iface)
+        inet = addresses.get(AF_INET)
+        if inet:
+            ips[iface] = inet[0]['addr']
+        link = addresses.get(AF_LINK)
+        if link and link[0].get('addr'):
+            macs[iface] = link[0]['addr'].lower()
+
+    return {
+        'hostname': hostname,
+        'ips': ips,
+        'macs': macs,
+        'platform': platform.system(),
+    }
+
+
+@logger
+class Facts(object):
+    """Cached host facts, refreshed periodically by the shared scheduler
+    and, on Linux, as soon as the kernel reports a link or address change.
+
+    Reading the facts resolves the hostname, which can hang on a slow
+    resolver. Periodic refreshes run on a thread of their own so that the
+    other scheduled jobs aren't delayed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Held while a background refresh runs
+        self._refreshing = threading.Lock()
+        self._facts = None
+        self._job = None
+        self._listener = None
+
+    def get(self):
+        facts = self._facts
+        if facts is None:
+            facts = self.refresh()
+        return facts
+
+    def refresh(self):
+        """Reads the facts again and returns them."""
+        with self._lock:
+            try:
+                facts = read_facts()
+            except Exception as err:
+                self.logger.error("Could not read host facts (%s)" % err)
+                if self._facts is not None:
+                    return self._facts
+                raise
+            if facts != self._facts:
+                self.logger.debug("Host facts: %s" % facts)
+            self._facts = facts
+            return facts
+
+    def refresh_in_background(self):
+        """Refreshes the facts on a new thread, unless a previous background
+        refresh is still running."""
+        if not self._refreshing.acquire(False):
+            self.logger.debug("Host facts are still being read")
+            return
+
+        def run():
+            try:
+                self.refresh()
+            except Exception:
+                # Already logged, the cached facts are kept
+                pass
+            finally:
+                self._refreshing.release()
+
+        thread = threading.Thread(target=run, name="FACTS")
+        thread.daemon = True
+        thread.start()
+
+    def start(self, interval=None):
+        if interval is None:
+            interval = config.controller['facts_interval']
+        self.refresh()
+        if interval > 0 and self._job is None:
+            self._job = get_scheduler().add_job(self.refresh_in_background,
+                                                interval, delay=interval)
+        if self._listener is None:
+            self._listener = NetlinkListener(self.refresh)
+            if self._listener.open():
+                self._listener.start()
+
+    def stop(self):
+        if self._job is not None:
+            get_scheduler().remove_job(self._job)
+            self._job = None
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+
+
+@logger
+class NetlinkListener(threading.Thread):
+    """Calls back when an interface or an address is added or removed.
+    Bursts of events, such as a DHCP renewal, trigger a single call.
+    """
+
+    def __init__(self, callback, settle=1):
+        threading.Thread.__init__(self, name="NETLINK")
+        self.daemon = True
+        self.callback = callback
+        self.settle = settle
+        self.sock = None
+        self._stopped = threading.Event()
+
+    def open(self):
+        if not hasattr(socket, 'AF_NETLINK'):
+            return False
+        groups = RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR
+        try:
+            self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                      NETLINK_ROUTE)
+            self.sock.bind((0, groups))
+        except socket.error as err:
+            self.logger.debug("Can't listen to netlink events (%s)" % err)
+            self.sock = None
+            return False
+        return True
+
+    def run(self):
+        while not self._stopped.isSet():
+            try:
+                self.sock.settimeout(None)
+                data = self.sock.recv(65536)
+                # Drain the rest of the burst before calling back
+                self.sock.settimeout(self.settle)
+                while True:
+                    try:
+                        self.sock.recv(65536)
+                    except socket.timeout:
+                        break
+            except socket.error as err:
+                # Events were lost if the receive buffer overflowed (ENOBUFS)
+                self.logger.debug("Netlink receive failed (%s)" % err)
+                data = ''
+            if self._stopped.isSet():
+                break
+            if len(data) >= 16:
+                msg_type = struct.unpack('=LHHLL', data[:16])[1]
+                self.logger.debug("Netlink event %d" % msg_type)
+            try:
+                self.callback()
+            except Exception as err:
+                self.logger.error("Netlink callback failed (%s)" % err)
+
+    def close(self):
+        self._stopped.set()
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            self.sock.close()
+
+
+_facts = Facts()
+
+
+def get_facts():
+    """Returns the facts shared across the agent."""
+    return _facts
@@ -0,0 +1,60 @@
+import re
+
+from synapse.facts import get_facts
+
+
+FILTERS = ('hostnames', 'ipaddresses', 'macaddresses', 'platforms', 'uuids')
+
+# Filter name -> module, loaded once
+_modules = {}
+
+# Wildcard pattern -> compiled regex
+_patterns = {}
+MAX_PATTERNS = 1024
+
+
+def get_filter(name):
+    """Returns the module checking the given filter, or None if there is no
+    such filter."""
+    try:
+        return _modules[name]
+    except KeyError:
+        pass
+    try:
+        module = __import__('synapse.filters.%s' % name, fromlist=['check'])
+    except ImportError:
+        module = None
+    _modules[name] = module
+    return module
+
+
+def load_filters():
+    for name in FILTERS:
+        get_filter(name)
+
+
+def get_pattern(wildcard):
+    """Returns the regex matching values starting like the given wildcard,
+    where '*' matches any string."""
+    try:
+        return _patterns[wildcard]
+    except KeyError:
+        pass
+    if len(_patterns) >= MAX_PATTERNS:
+        _patterns.clear()
+    pattern = _patterns[wildcard] = re.compile(
+        wildcard.replace(".", "\.").replace("*", ".*"))
+    return pattern
+
+
+def match_any(wildcards, values):
+    for wildcard in wildcards:
+        pattern = get_pattern(wildcard)
+        for value in values:
+            if pattern.match(value):
+                return True
+    return False
+
+
+def get_host_facts():
+    return get_facts().get()
@@ -1,18 +1,5 @@
-import socket
-import re
+from synapse.filters import get_host_facts, match_any
 
 
 def check(hostnames):
-
-    match = False
-    actual_hostname = socket.gethostbyaddr(socket.gethostname())[0]
-
-    for hostname in hostnames:
-        newhostname = hostname.replace(".", "\.")
-        newhostname = newhostname.replace("*", ".*")
-        regex = re.compile(newhostname)
-        if re.match(regex, actual_hostname):
-            match = True
-            break
-
-    return match
+    return match_any(hostnames, (get_host_facts()['hostname'],))
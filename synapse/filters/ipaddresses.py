@@ -1,22 +1,5 @@
-import re
-from netifaces import interfaces, ifaddresses, AF_INET
+from synapse.filters import get_host_facts, match_any
 
 
 def check(ipaddresses):
-    match = False
-    ips = {}
-    for ifaceName in interfaces():
-        addresses = [i['addr']
-                     for i in ifaddresses(ifaceName).setdefault(AF_INET,
-                                                [{'addr':'No IP addr'}])]
-        if len(addresses):
-            ips[ifaceName] = addresses[0]
-    for ip in ipaddresses:
-        newip = ip.replace(".", "\.")
-        newip = newip.replace("*", ".*")
-        regex = re.compile(newip)
-        for value in ips.values():
-            if re.match(regex, value):
-                return True
-
-    return match
+    return match_any(ipaddresses, get_host_facts()['ips'].values())
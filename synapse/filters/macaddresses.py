@@ -1,12 +1,11 @@
-import os
+from synapse.filters import get_host_facts
 
 
 def check(mac_addresses):
-    ifconfig = os.popen('ifconfig').readlines()
-    found = False
-    for line in ifconfig:
-        for ma in mac_addresses:
-            if ma in line:
-                found = True
-                break
-    return found
+    macs = get_host_facts()['macs'].values()
+    for ma in mac_addresses:
+        ma = ma.lower()
+        for mac in macs:
+            if ma in mac:
+                return True
+    return False
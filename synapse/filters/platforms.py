@@ -1,5 +1,5 @@
-import platform
+from synapse.filters import get_host_facts
 
 
 def check(platforms):
-    return platform.system() in platforms
+    return get_host_facts()['platform'] in platforms
@@ -0,0 +1,270 @@
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+
+from synapse.logger import logger
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o0004000
+
+# Events on the entries of a watched directory we care about
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+              IN_MOVE_SELF | IN_ONLYDIR)
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+_libc = None
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                        use_errno=True)
+    _libc.inotify_init1
+except (OSError, AttributeError):
+    _libc = None
+
+
+def is_available():
+    return _libc is not None
+
+
+class Inotify(object):
+    """Thin wrapper around the inotify system calls."""
+
+    def __init__(self):
+        if _libc is None:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.fd = _libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = _libc.inotify_add_watch(self.fd, path, mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd):
+        _libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self):
+        """Returns a list of (wd, mask, name) tuples for the pending events.
+        """
+        events = []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as err:
+            if err.errno in (errno.EAGAIN, errno.EINTR):
+                return events
+            raise
+
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip('\0')
+            offset += length
+            events.append((wd, mask, name))
+
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+@logger
+class FileWatcher(threading.Thread):
+    """Watches the paths of monitored resources and asks their controllers
+    to check the compliance of the paths that changed.
+
+    Paths are watched through their parent directory, so that replaced,
+    created and deleted files are noticed. If the parent directory doesn't
+    exist, the closest existing ancestor is watched until it is created.
+    """
+
+    # Seconds to wait for more events before checking changed paths, so
+    # that a burst of writes only triggers one check.
+    DEBOUNCE = .1
+
+    def __init__(self):
+        threading.Thread.__init__(self, name="FILEWATCHER")
+        self.daemon = True
+        self.inotify = Inotify()
+        self._lock = threading.Lock()
+        self._running = True
+
+        # wd -> watched directory and watched directory -> wd
+        self._wds = {}
+        self._dirs = {}
+
+        # path -> (watched directory, set of controllers)
+        self._paths = {}
+
+        # watched directory -> entry name -> paths at or under that entry,
+        # so that each event is matched with a single lookup
+        self._entries = {}
+
+        # paths whose controller was busy, to check again
+        self._retries = set()
+
+    def watch(self, controller, path):
+        with self._lock:
+            if path in self._paths:
+                self._paths[path][1].add(controller)
+            else:
+                self._paths[path] = [None, set([controller])]
+                self._watch_path(path)
+
+    def unwatch(self, controller, path):
+        with self._lock:
+            if path not in self._paths:
+                return
+            controllers = self._paths[path][1]
+            controllers.discard(controller)
+            if not controllers:
+                directory = self._paths.pop(path)[0]
+                self._unindex(path, directory)
+                self._release_dir(directory)
+
+    def _watch_path(self, path):
+        directory = os.path.dirname(os.path.abspath(path))
+        while not os.path.isdir(directory):
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                break
+            directory = parent
+
+        previous = self._paths[path][0]
+        if previous == directory and directory in self._dirs:
+            return
+
+        if directory not in self._dirs:
+            try:
+                wd = self.inotify.add_watch(directory)
+            except OSError as err:
+                self.logger.warning("Can't watch %s (%s)" % (directory, err))
+                return
+            self._dirs[directory] = wd
+            self._wds[wd] = directory
+
+        self._paths[path][0] = directory
+        self._unindex(path, previous)
+        self._index(path, directory)
+        self._release_dir(previous)
+
+    def _get_entry(self, path, directory):
+        # Name of the entry of directory that is or contains path
+        relpath = os.path.relpath(os.path.abspath(path), directory)
+        return relpath.split(os.sep)[0]
+
+    def _index(self, path, directory):
+        entries = self._entries.setdefault(directory, {})
+        entries.setdefault(self._get_entry(path, directory), set()).add(path)
+
+    def _unindex(self, path, directory):
+        entries = self._entries.get(directory)
+        if entries is None:
+            return
+        name = self._get_entry(path, directory)
+        paths = entries.get(name, set())
+        paths.discard(path)
+        if not paths:
+            entries.pop(name, None)
+        if not entries:
+            del self._entries[directory]
+
+    def _release_dir(self, directory):
+        if directory is None or directory not in self._dirs:
+            return
+        if directory in self._entries:
+            return
+        wd = self._dirs.pop(directory)
+        del self._wds[wd]
+        self.inotify.rm_watch(wd)
+
+    def _get_changed_paths(self, events):
+        changed = set()
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                return set(self._paths.keys())
+
+            directory = self._wds.get(wd)
+            if directory is None:
+                continue
+
+            entries = self._entries.get(directory, {})
+            if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                # The watched directory itself is gone
+                del self._dirs[directory]
+                del self._wds[wd]
+                for paths in entries.itervalues():
+                    changed.update(paths)
+            else:
+                changed.update(entries.get(name, ()))
+
+        return changed
+
+    def run(self):
+        self.logger.debug("File watcher started.")
+        poller = select.poll()
+        poller.register(self.inotify.fileno(), select.POLLIN)
+
+        while self._running:
+            timeout = 1000 if not self._retries else self.DEBOUNCE * 1000
+            if not poller.poll(timeout) and not self._retries:
+                continue
+
+            time.sleep(self.DEBOUNCE)
+            events = []
+            while True:
+                batch = self.inotify.read_events()
+                if not batch:
+                    break
+                events.extend(batch)
+
+            with self._lock:
+                changed = self._get_changed_paths(events) | self._retries
+                self._retries = set()
+                targets = []
+                for path in changed:
+                    if path not in self._paths:
+                        continue
+                    # Directories may have been created or deleted
+                    self._watch_path(path)
+                    for controller in self._paths[path][1]:
+                        targets.append((controller, path))
+
+            for controller, path in targets:
+                try:
+                    if not controller.monitor_state(path):
+                        self._retries.add(path)
+                except Exception as err:
+                    self.logger.error("Could not check %s (%s)" % (path, err))
+
+        self.inotify.close()
+        self.logger.debug("File watcher stopped.")
+
+    def shutdown(self):
+        self._running = False
@@ -1,4 +1,8 @@
+import os
 import re
+import threading
+
+from collections import OrderedDict
 
 from synapse.logger import logger
 
@@ -11,8 +15,36 @@ perm_mapping = {"C": "create",
 
 log = logger(__name__)
 
+# Number of (user, collection, res_id) decisions remembered
+CACHE_SIZE = 1024
+
+# Permissions file path -> (stat key, PermissionSet)
+_loaded = {}
+_loaded_lock = threading.Lock()
+
 
 def get(permission_file_path):
+    """Returns the permissions of the file. The file is only read again when
+    its modification time or size changes.
+    """
+    try:
+        si = os.stat(permission_file_path)
+        key = (si.st_ino, si.st_size, si.st_mtime)
+    except OSError:
+        key = None
+
+    with _loaded_lock:
+        if key is not None and permission_file_path in _loaded:
+            loaded_key, permissions = _loaded[permission_file_path]
+            if loaded_key == key:
+                return permissions
+
+        permissions = PermissionSet(_read(permission_file_path))
+        _loaded[permission_file_path] = (key, permissions)
+        return permissions
+
+
+def _read(permission_file_path):
     """Reads the permissions file line by line and process them.
     Returns an array of permissions array.
     """
@@ -92,6 +124,12 @@ def _sanitize(item):
 
 
 def check(permissions, user, collection, res_id):
+    if isinstance(permissions, PermissionSet):
+        return permissions.check(user, collection, res_id)
+    return _check(permissions, user, collection, res_id)
+
+
+def _check(permissions, user, collection, res_id):
     for perm in permissions:
         user_match = perm[0].match(user)
         collection_match = perm[1].match(collection)
@@ -102,3 +140,75 @@ def check(permissions, user, collection, res_id):
             return perm[3]
 
     return []
+
+
+def _get_literal(regex):
+    """Returns the text a user or collection pattern must start with, or
+    None if it matches anything."""
+    if regex.pattern in ('', '.*'):
+        return None
+    return regex.pattern
+
+
+class PermissionSet(list):
+    """Permissions of a file, indexed by the literal user and collection of
+    each line so that only the lines which may match are tried, in file
+    order. Decisions are remembered in a bounded LRU cache.
+    """
+
+    def __init__(self, permissions, cache_size=CACHE_SIZE):
+        super(PermissionSet, self).__init__(permissions)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+        # (user literal, collection literal) -> indexes of the lines
+        self._index = {}
+        self._user_lengths = set()
+        self._collection_lengths = set()
+        for position, perm in enumerate(self):
+            user = _get_literal(perm[0])
+            collection = _get_literal(perm[1])
+            if user is not None:
+                self._user_lengths.add(len(user))
+            if collection is not None:
+                self._collection_lengths.add(len(collection))
+            self._index.setdefault((user, collection), []).append(position)
+
+    def _get_prefixes(self, value, lengths):
+        # Patterns are matched from the beginning of the value only
+        return [None] + [value[:length] for length in lengths
+                         if length <= len(value)]
+
+    def _get_candidates(self, user, collection):
+        candidates = []
+        for user_key in self._get_prefixes(user, self._user_lengths):
+            for collection_key in self._get_prefixes(
+                    collection, self._collection_lengths):
+                candidates.extend(self._index.get((user_key, collection_key),
+                                                  ()))
+        candidates.sort()
+        return candidates
+
+    def check(self, user, collection, res_id):
+        key = (user, collection, res_id)
+        with self._lock:
+            try:
+                allowed = self._cache.pop(key)
+                self._cache[key] = allowed
+                return allowed
+            except KeyError:
+                pass
+
+        allowed = []
+        for position in self._get_candidates(user, collection):
+            perm = self[position]
+            if perm[2].match(res_id):
+                allowed = perm[3]
+                break
+
+        with self._lock:
+            self._cache[key] = allowed
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return allowed
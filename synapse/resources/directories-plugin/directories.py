@@ -11,6 +11,8 @@ class DirectoriesController(ResourcesController):
 
     __resource__ = "directories"
 
+    __watchable__ = True
+
     def read(self, res_id=None, attributes={}):
         status = {}
         self.check_mandatory(res_id)
@@ -0,0 +1,86 @@
+import os
+import stat
+import pickle
+import tempfile
+import threading
+
+from synapse.config import config
+from synapse.logger import logger
+
+
+def stat_key(si):
+    """Returns the part of a stat record that changes when the content of a
+    file may have changed.
+    """
+    mtime_ns = getattr(si, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(round(si.st_mtime * 10 ** 9))
+    return (si.st_ino, si.st_size, mtime_ns)
+
+
+@logger
+class DigestCache(object):
+    """Persistent cache of files digests. A digest is reused as long as the
+    inode, size and modification time of the file don't change.
+    """
+
+    def __init__(self, name='files-digests.pkl'):
+        self.path = os.path.join(config.controller['persistence_path'], name)
+        self._lock = threading.Lock()
+        self._dirty = False
+
+        # path -> (stat key, algorithm, digest)
+        self._entries = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as fd:
+                return pickle.load(fd)
+        except (IOError, EOFError, pickle.UnpicklingError, ValueError):
+            return {}
+
+    def get(self, path, si, algorithm, compute):
+        """Returns the digest of the file at path, whose stat record is si,
+        calling compute(path, algorithm) only if it's not cached.
+        """
+        key = stat_key(si)
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is not None and entry[0] == key and entry[1] == algorithm:
+            return entry[2]
+
+        digest = compute(path, algorithm)
+        self.set(path, si, algorithm, digest)
+        return digest
+
+    def set(self, path, si, algorithm, digest):
+        with self._lock:
+            self._entries[path] = (stat_key(si), algorithm, digest)
+            self._dirty = True
+
+    def save(self, paths=None):
+        """Atomically writes the cache on disk if it changed. If paths is
+        given, entries for other paths are dropped.
+        """
+        with self._lock:
+            if paths is not None:
+                for path in self._entries.keys():
+                    if path not in paths:
+                        del self._entries[path]
+                        self._dirty = True
+
+            if not self._dirty:
+                return
+
+            try:
+                folder = os.path.dirname(self.path)
+                fd, tmp_path = tempfile.mkstemp(dir=folder, prefix='digests')
+                with os.fdopen(fd, 'wb') as tmp:
+                    pickle.dump(self._entries, tmp, pickle.HIGHEST_PROTOCOL)
+                os.chmod(tmp_path, stat.S_IREAD | stat.S_IWRITE)
+                if os.name == 'nt' and os.path.exists(self.path):
+                    os.remove(self.path)
+                os.rename(tmp_path, self.path)
+                self._dirty = False
+            except (IOError, OSError) as err:
+                self.logger.error(err)
@@ -2,23 +2,37 @@ import base64
 import getpass
 import urllib2
 from datetime import datetime
-from urllib2 import URLError
 
 from synapse.resources.resources import ResourcesController
+from synapse.config import config
 from synapse.logger import logger
 from synapse.synapse_exceptions import ResourceException
 
+from digests import DigestCache
+
 
 @logger
 class FilesController(ResourcesController):
 
     __resource__ = "files"
 
+    __watchable__ = True
+
+    # Size of the chunks in which contents are transferred
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, module):
+        super(FilesController, self).__init__(module)
+        self.hash_algorithm = config.compliance['hash_algorithm']
+        self.digests = DigestCache()
+
     def read(self, res_id=None, attributes={}):
         self.check_mandatory(res_id)
         status = {}
 
-        present = self.module.is_file(res_id)
+        # All attributes are derived from a single stat call
+        si = self.module.stat(res_id)
+        present = si is not None
         status['name'] = res_id
         status['present'] = present
         if present:
@@ -26,16 +40,27 @@ class FilesController(ResourcesController):
                 content = self.module.get_content(res_id)
                 status['content'] = content
             if attributes.get('md5'):
-                md5 = self.module.md5(res_id)
-                status['md5'] = md5
-            status['owner'] = self.module.owner(res_id)
-            status['group'] = self.module.group(res_id)
-            status['mode'] = self.module.mode(res_id)
-            status['mod_time'] = self.module.mod_time(res_id)
-            status['c_time'] = self.module.c_time(res_id)
+                status['md5'] = self._digest(res_id, si, 'md5')
+            status.update(self.module.attributes(si))
 
         return status
 
+    def monitor_states(self):
+        # Owner and group names are looked up once per monitoring sweep
+        self.module.clear_names_cache()
+        super(FilesController, self).monitor_states()
+        self.digests.save(set(state['resource_id'] for state in self.states))
+
+    def close(self):
+        super(FilesController, self).close()
+        self.digests.save()
+
+    def _digest(self, path, si, algorithm=None):
+        """Returns the digest of a file, only hashing it if it changed since
+        it was last hashed."""
+        algorithm = algorithm or self.hash_algorithm
+        return self.digests.get(path, si, algorithm, self.module.digest)
+
     def create(self, res_id=None, attributes={}):
         '''
         This method is used to create or update a file on disk.
@@ -51,7 +76,24 @@ class FilesController(ResourcesController):
         owner = self._get_owner(res_id, attributes)
         group = self._get_group(res_id, attributes)
         mode = self._get_mode(res_id, attributes)
-        content = self._get_content(attributes)
+        algorithm = self.hash_algorithm
+
+        # The content is downloaded, decoded and hashed into a temporary
+        # file before anything is changed on disk. Inline content is already
+        # in memory: it's only staged if it differs from the file's.
+        chunks = self._get_content(attributes)
+        staged = None
+        digest = None
+        if chunks is not None and not attributes.get('content_by_url'):
+            content = ''.join(chunks)
+            digest = self.module.digest_str(content, algorithm)
+            if not self._is_identical(res_id, self.module.stat(res_id),
+                                      digest, len(content), algorithm):
+                staged = self.module.stage_content(res_id, [content],
+                                                   algorithm)
+        elif chunks is not None:
+            staged = self.module.stage_content(res_id, chunks, algorithm)
+            digest = staged[1]
 
         state = {
             'name': res_id,
@@ -61,21 +103,59 @@ class FilesController(ResourcesController):
             'mod_time': str(datetime.now()),
             'c_time': str(datetime.now()),
             'present': True,
-            'md5': self.module.md5_str(content)
+            'hash': algorithm,
+            algorithm: digest
         }
 
-        self.save_state(res_id, state, monitor=monitor)
-
-        if not self.module.exists(res_id):
-            self.module.create_file(res_id)
-
-        # Update meta of given file
-        self.module.update_meta(res_id, owner, group, mode)
-
-        # Set the content in file only if it's a file
-        self.module.set_content(res_id, content)
+        changed = False
+        try:
+            si = self.module.stat(res_id)
+            if staged is not None:
+                # Leave the file untouched if its content is the same
+                if not self._is_identical(res_id, si, staged[1], staged[2],
+                                          algorithm):
+                    self.module.commit_content(staged[0], res_id)
+                    staged = None
+                    changed = True
+            elif si is None:
+                self.module.create_file(res_id)
+                changed = True
+
+            # Update meta of given file
+            if self.module.update_meta(res_id, owner, group, mode):
+                changed = True
+
+            # The file content is known, no need to hash it again
+            si = self.module.stat(res_id)
+            if chunks is None:
+                state[algorithm] = self._digest(res_id, si)
+            else:
+                self.digests.set(res_id, si, algorithm, state[algorithm])
+
+        finally:
+            if staged is not None:
+                self.module.discard_content(staged[0])
+
+            # Record the actual modification times so that the monitoring
+            # doesn't hash the file until it's modified. They are read from
+            # the stat record alone: owner and group lookups may fail and
+            # must not hide the original error nor prevent saving the state.
+            si = self.module.stat(res_id)
+            if si is not None:
+                state['mod_time'] = str(datetime.fromtimestamp(si.st_mtime))
+                state['c_time'] = str(datetime.fromtimestamp(si.st_ctime))
+            self.save_state(res_id, state, monitor=monitor)
+
+        status = self.read(res_id=res_id, attributes=attributes)
+        status['changed'] = changed
+        return status
 
-        return self.read(res_id=res_id, attributes=attributes)
+    def _is_identical(self, path, si, digest, size, algorithm):
+        """Tells whether the file at path, whose stat record is si, has the
+        given content digest and size."""
+        if si is None or si.st_size != size:
+            return False
+        return self._digest(path, si, algorithm) == digest
 
     def update(self, res_id=None, attributes={}):
         '''See create method'''
@@ -124,10 +204,16 @@ class FilesController(ResourcesController):
         elif current_mode != persisted_mode:
                 compliant = False
 
-        # Then compare modification times. If different, check md5sum
+        # Then compare modification times. If different, check the digest.
+        # The file is only hashed if it changed since it was last hashed.
         if persisted_state.get('mod_time') != current_state.get('mod_time'):
-            current_state_md5 = self.module.md5(persisted_state['name'])
-            if current_state_md5 != persisted_state.get('md5'):
+            algorithm = persisted_state.get('hash', 'md5')
+            si = self.module.stat(persisted_state['name'])
+            current_digest = None
+            if si is not None:
+                current_digest = self._digest(persisted_state['name'], si,
+                                              algorithm)
+            if current_digest != persisted_state.get(algorithm):
                 compliant = False
 
         return compliant
@@ -177,24 +263,61 @@ class FilesController(ResourcesController):
         return mode
 
     def _get_content(self, attributes):
+        """Returns an iterator over the chunks of the provided content, or
+        None if no content is provided."""
         content = attributes.get('content')
         content_by_url = attributes.get('content_by_url')
         encoding = attributes.get('encoding')
 
         # If content is url provided, overwrite content
         if content_by_url:
-            try:
-                fd = urllib2.urlopen(content_by_url)
-                content = fd.read()
-            except URLError, err:
-                raise ResourceException("Error: %s (%s)" %
-                        (err, content_by_url))
+            chunks = self._download(content_by_url)
+        elif content is not None:
+            chunks = self._split(content)
+        else:
+            return None
 
         # Decode if content is base64 encoded.
         if encoding == 'base64':
-            try:
-                content = base64.b64decode(content)
-            except TypeError, err:
-                raise ResourceException("Can't b64decode: %s" % err)
+            chunks = self._b64decode(chunks)
 
-        return content
+        return chunks
+
+    def _download(self, url):
+        try:
+            fd = urllib2.urlopen(url)
+            try:
+                while True:
+                    chunk = fd.read(self.CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    yield chunk
+            finally:
+                fd.close()
+        except IOError, err:
+            raise ResourceException("Error: %s (%s)" % (err, url))
+
+    def _split(self, content):
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+        elif not isinstance(content, str):
+            content = str(content)
+
+        for offset in xrange(0, len(content), self.CHUNK_SIZE):
+            yield content[offset:offset + self.CHUNK_SIZE]
+
+    def _b64decode(self, chunks):
+        # Base64 is decoded by groups of 4 characters, the remainder of a
+        # chunk is kept for the next one.
+        pending = ''
+        try:
+            for chunk in chunks:
+                pending += ''.join(chunk.split())
+                size = len(pending) - len(pending) % 4
+                if size:
+                    yield base64.b64decode(pending[:size])
+                    pending = pending[size:]
+            if pending:
+                yield base64.b64decode(pending)
+        except TypeError, err:
+            raise ResourceException("Can't b64decode: %s" % err)
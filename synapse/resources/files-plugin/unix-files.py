@@ -3,11 +3,23 @@ import grp
 import hashlib
 import os
 import pwd
+import shutil
+import stat as stat_module
+import tempfile
 import logging
 
+try:
+    import xattr
+except ImportError:
+    xattr = None
+
 from synapse.synapse_exceptions import ResourceException
 log = logging.getLogger('synapse.unix-files')
 
+# uid and gid to name lookups, cleared by clear_names_cache
+_owners = {}
+_groups = {}
+
 
 def exists(path):
     try:
@@ -23,6 +35,53 @@ def is_file(path):
         return False
 
 
+def stat(path):
+    """Returns the stat record of path or None if path is not a file."""
+    try:
+        si = os.stat(path)
+    except OSError:
+        return None
+
+    if not stat_module.S_ISREG(si.st_mode):
+        return None
+
+    return si
+
+
+def attributes(si):
+    """Returns the file attributes derived from a stat record."""
+    return {
+        'owner': _get_owner_name(si.st_uid),
+        'group': _get_group_name(si.st_gid),
+        'mode': ("%o" % si.st_mode)[-4:],
+        'mod_time': str(datetime.datetime.fromtimestamp(si.st_mtime)),
+        'c_time': str(datetime.datetime.fromtimestamp(si.st_ctime))
+    }
+
+
+def clear_names_cache():
+    _owners.clear()
+    _groups.clear()
+
+
+def _get_owner_name(uid):
+    if uid not in _owners:
+        try:
+            _owners[uid] = pwd.getpwuid(uid).pw_name
+        except KeyError as err:
+            raise ResourceException(err)
+    return _owners[uid]
+
+
+def _get_group_name(gid):
+    if gid not in _groups:
+        try:
+            _groups[gid] = grp.getgrgid(gid).gr_name
+        except KeyError as err:
+            raise ResourceException(err)
+    return _groups[gid]
+
+
 def list_dir(path):
     if not os.path.exists(path):
         raise ResourceException("Folder not found, sorry !")
@@ -49,27 +108,137 @@ def set_content(path, content):
             fd.write(str(content))
 
 
-def md5(path, block_size=2 ** 20):
+def stage_content(path, chunks, algorithm='md5'):
+    """Writes the chunks to a temporary file in the folder of path, hashing
+    them on the way. Returns the temporary path, the content digest and the
+    content size.
+    """
+    # Symlinks are followed, the temporary file must be on the same
+    # filesystem as the file it replaces.
+    path = os.path.realpath(path)
+    folder = os.path.dirname(path)
+    if not os.path.exists(folder):
+        create_folders(folder)
+
+    fd, tmp_path = tempfile.mkstemp(dir=folder,
+                                    prefix='.%s.' % os.path.basename(path))
+    size = 0
+    try:
+        h = new_hash(algorithm)
+        with os.fdopen(fd, 'wb') as tmp:
+            for chunk in chunks:
+                h.update(chunk)
+                tmp.write(chunk)
+                size += len(chunk)
+            tmp.flush()
+            os.fsync(tmp.fileno())
+    except:
+        discard_content(tmp_path)
+        raise
+
+    return tmp_path, h.hexdigest(), size
+
+
+def commit_content(tmp_path, path):
+    """Replaces the content of path, or of the file it links to, by the
+    staged file. The staged file is renamed over it unless that would break
+    hardlinks or lose extended attributes (such as the SELinux context), in
+    which case the file is rewritten in place.
+    """
+    path = os.path.realpath(path)
+    if os.path.exists(path) and not is_file(path):
+        discard_content(tmp_path)
+        raise ResourceException('File not found')
+
+    try:
+        si = os.stat(path)
+    except OSError:
+        os.rename(tmp_path, path)
+        return
+
+    if si.st_nlink > 1 or not _copy_xattrs(path, tmp_path):
+        try:
+            _write_in_place(tmp_path, path)
+        finally:
+            discard_content(tmp_path)
+        return
+
+    os.rename(tmp_path, path)
+
+
+def _copy_xattrs(src, dst):
+    """Copies the extended attributes of src, SELinux context and ACLs
+    included, to dst. Returns False if they can't be copied."""
+    if xattr is None:
+        return False
+    try:
+        for name in xattr.listxattr(src):
+            xattr.setxattr(dst, name, xattr.getxattr(src, name))
+    except (IOError, OSError) as err:
+        log.debug("Can't copy extended attributes of %s (%s)" % (src, err))
+        return False
+    return True
+
+
+def _write_in_place(tmp_path, path):
+    with open(tmp_path, 'rb') as src:
+        with open(path, 'r+b') as dst:
+            shutil.copyfileobj(src, dst)
+            dst.truncate()
+            dst.flush()
+            os.fsync(dst.fileno())
+
+
+def discard_content(tmp_path):
+    try:
+        os.remove(tmp_path)
+    except OSError:
+        pass
+
+
+def new_hash(algorithm='md5'):
+    try:
+        return hashlib.new(algorithm)
+    except ValueError:
+        pass
+
+    # Python < 3.6 needs pyblake2 for blake2b and blake2s
+    try:
+        import pyblake2
+        return getattr(pyblake2, algorithm)()
+    except (ImportError, AttributeError):
+        raise ResourceException("Unsupported hash algorithm: %s" % algorithm)
+
+
+def digest(path, algorithm='md5', block_size=2 ** 20):
     if not os.path.isfile(path):
         return None
 
-    with open(path, 'r') as f:
-        md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        h = new_hash(algorithm)
         while True:
             data = f.read(block_size)
             if not data:
                 break
-            md5.update(data)
-        return md5.hexdigest()
+            h.update(data)
+        return h.hexdigest()
 
 
-def md5_str(content):
+def digest_str(content, algorithm='md5'):
     if content is None:
         content = ''
 
-    m = hashlib.md5()
-    m.update(content)
-    return m.hexdigest()
+    h = new_hash(algorithm)
+    h.update(content)
+    return h.hexdigest()
+
+
+def md5(path, block_size=2 ** 20):
+    return digest(path, 'md5', block_size)
+
+
+def md5_str(content):
+    return digest_str(content, 'md5')
 
 
 def create_file(path):
@@ -95,19 +264,30 @@ def create_folders(path):
 
 
 def update_meta(path, owner, group, filemode):
-    if not os.path.exists(path):
+    """Sets the owner, group and mode of path if they differ. Returns True
+    if anything was changed."""
+    try:
+        si = os.stat(path)
+    except OSError:
         raise ResourceException('This path does not exist.')
 
     ownerid = get_owner_id(owner)
     groupid = get_group_id(group)
     octfilemode = int(filemode, 8)
 
+    changed = False
     try:
-        os.chmod(path, octfilemode)
-        os.chown(path, ownerid, groupid)
+        if stat_module.S_IMODE(si.st_mode) != octfilemode:
+            os.chmod(path, octfilemode)
+            changed = True
+        if (si.st_uid, si.st_gid) != (ownerid, groupid):
+            os.chown(path, ownerid, groupid)
+            changed = True
     except ValueError as err:
         raise ResourceException(err)
 
+    return changed
+
 
 def delete(path):
     try:
@@ -1,6 +1,7 @@
 import os
 import hashlib
 import datetime
+import tempfile
 
 from synapse.synapse_exceptions import ResourceException
 from synapse.syncmd import exec_cmd
@@ -14,6 +15,32 @@ def exists(path):
         return False
 
 
+def stat(path):
+    try:
+        si = os.stat(path)
+    except OSError:
+        return None
+
+    if not os.path.isfile(path):
+        return None
+
+    return si
+
+
+def attributes(si):
+    return {
+        'owner': None,
+        'group': None,
+        'mode': None,
+        'mod_time': str(datetime.datetime.fromtimestamp(si.st_mtime)),
+        'c_time': str(datetime.datetime.fromtimestamp(si.st_ctime))
+    }
+
+
+def clear_names_cache():
+    pass
+
+
 def list_dir(path):
     if not os.path.exists(path):
         raise ResourceException("Folder not found, sorry !")
@@ -42,23 +69,75 @@ def set_content(path, content):
         fd.write(str(content))
 
 
-def md5(path, block_size=2 ** 20):
+def stage_content(path, chunks, algorithm='md5'):
+    _path = os.path.join("/", path)
+    folder = os.path.dirname(_path)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    fd, tmp_path = tempfile.mkstemp(dir=folder)
+    size = 0
+    try:
+        h = new_hash(algorithm)
+        with os.fdopen(fd, 'wb') as tmp:
+            for chunk in chunks:
+                h.update(chunk)
+                tmp.write(chunk)
+                size += len(chunk)
+    except:
+        discard_content(tmp_path)
+        raise
+
+    return tmp_path, h.hexdigest(), size
+
+
+def commit_content(tmp_path, path):
+    # Windows can't rename over an existing file
+    _path = os.path.join("/", path)
+    if os.path.exists(_path):
+        os.remove(_path)
+    os.rename(tmp_path, _path)
+
+
+def discard_content(tmp_path):
+    try:
+        os.remove(tmp_path)
+    except OSError:
+        pass
+
+
+def new_hash(algorithm='md5'):
+    try:
+        return hashlib.new(algorithm)
+    except ValueError:
+        raise ResourceException("Unsupported hash algorithm: %s" % algorithm)
+
+
+def digest(path, algorithm='md5', block_size=2 ** 20):
     if not os.path.exists(path):
         raise ResourceException('File not found')
-    with open(path, 'r') as f:
-        md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        h = new_hash(algorithm)
         while True:
             data = f.read(block_size)
             if not data:
                 break
-            md5.update(data)
-        return md5.hexdigest()
+            h.update(data)
+        return h.hexdigest()
+
+
+def digest_str(content, algorithm='md5'):
+    h = new_hash(algorithm)
+    h.update(content)
+    return h.hexdigest()
+
+
+def md5(path, block_size=2 ** 20):
+    return digest(path, 'md5', block_size)
 
 
 def md5_str(content):
-    m = hashlib.md5()
-    m.update(content)
-    return m.hexdigest()
+    return digest_str(content, 'md5')
 
 
 def create_file(id):
@@ -82,7 +161,7 @@ def create_file(id):
 
 
 def update_meta(id, owner, group, mode):
-    pass
+    return False
 
 
 def delete(path):
@@ -7,6 +7,10 @@ class GroupsController(ResourcesController):
 
     __resource__ = "groups"
 
+    # useradd, groupadd and friends fail instead of waiting when the
+    # passwd/group files are locked.
+    __exclusive__ = True
+
     def read(self, res_id=None, attributes=None):
         return self.module.get_group_infos(res_id)
 
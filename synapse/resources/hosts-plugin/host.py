@@ -1,15 +1,22 @@
+import os
+import time
 import logging
 import socket
+import threading
 
 from netifaces import interfaces, ifaddresses, AF_INET, AF_LINK
 
 from synapse.config import config
+from synapse.timeseries import TimeSeriesStore
 
 controller_options = config.controller
 distribution_name = controller_options['distribution_name']
 distribution_version = controller_options['distribution_version']
 log = logging.getLogger('synapse.hosts')
 
+# History of the sampled cpu, load and memory usage
+history = TimeSeriesStore()
+
 
 def get_uuid():
     return config.rabbitmq['uuid']
@@ -24,11 +31,109 @@ def get_platform():
 
 
 def get_cpu():
-    try:
-        import psutil
-        return str(psutil.cpu_percent(interval=1))
-    except ImportError:
-        return 0
+    """Returns the CPU usage percentage between the last two samples."""
+    latest, previous = _get_samples()
+    if latest is None:
+        try:
+            import psutil
+            return str(psutil.cpu_percent(interval=None))
+        except ImportError:
+            return 0
+
+    return str(_get_cpu_percent(latest, previous))
+
+
+def _get_cpu_percent(latest, previous=None):
+    total, idle = latest['cpu']
+    if previous is not None:
+        total -= previous['cpu'][0]
+        idle -= previous['cpu'][1]
+    if total <= 0:
+        return 0.
+    return round(100. * (total - idle) / total, 1)
+
+
+def get_history(name, window):
+    """Returns the min, avg and max of a sampled metric (cpu, load or
+    memory) over the last window seconds, or None."""
+    if _get_samples()[0] is None:
+        return None
+    return history.aggregate(name, window)
+
+
+def get_loadavg():
+    latest, previous = _get_samples()
+    if latest is None:
+        return None
+    return list(latest['load'])
+
+
+def get_memory():
+    """Returns the memory figures in kB and the percentage in use."""
+    latest, previous = _get_samples()
+    if latest is None:
+        return None
+    mem = latest['mem']
+    total = mem.get('MemTotal', 0)
+    available = mem.get('MemAvailable',
+                        mem.get('MemFree', 0) + mem.get('Buffers', 0) +
+                        mem.get('Cached', 0))
+    return {
+        'total': total,
+        'free': mem.get('MemFree', 0),
+        'available': available,
+        'swap_total': mem.get('SwapTotal', 0),
+        'swap_free': mem.get('SwapFree', 0),
+        'used_percent': _get_memory_percent(mem)
+    }
+
+
+def _get_memory_percent(mem):
+    total = mem.get('MemTotal', 0)
+    available = mem.get('MemAvailable',
+                        mem.get('MemFree', 0) + mem.get('Buffers', 0) +
+                        mem.get('Cached', 0))
+    if not total:
+        return 0.
+    return round(100. * (total - available) / total, 1)
+
+
+def get_disk_rates():
+    """Returns the reads and writes per second of each disk."""
+    names = ('reads_per_sec', 'read_bytes_per_sec',
+             'writes_per_sec', 'write_bytes_per_sec')
+    rates = _get_rates('disks', names)
+    for rate in rates.itervalues():
+        # Counters are in 512 bytes sectors
+        rate['read_bytes_per_sec'] *= 512
+        rate['write_bytes_per_sec'] *= 512
+    return rates
+
+
+def get_net_rates():
+    """Returns the bytes and packets per second of each interface."""
+    names = ('rx_bytes_per_sec', 'rx_packets_per_sec',
+             'tx_bytes_per_sec', 'tx_packets_per_sec')
+    return _get_rates('net', names)
+
+
+def _get_rates(metric, names):
+    latest, previous = _get_samples()
+    if latest is None or previous is None:
+        return {}
+    elapsed = latest['time'] - previous['time']
+    if elapsed <= 0:
+        return {}
+
+    rates = {}
+    for device, counters in latest[metric].iteritems():
+        before = previous[metric].get(device)
+        if before is None:
+            continue
+        rates[device] = dict(
+            (name, round(max(0, value - old) / elapsed, 1))
+            for name, value, old in zip(names, counters, before))
+    return rates
 
 
 def get_hostname():
@@ -55,14 +160,10 @@ def get_mac_addresses():
 def get_memtotal():
     controller_config = config.controller
     if controller_config['distribution_name'] != 'windows':
-        memtotal = ''
-        try:
-            with open('/proc/meminfo', 'rb') as fd:
-                lines = fd.readlines()
-                memtotal = lines[0].split()[1]
-        except OSError, err:
-            return "{0}".format(err)
-        return memtotal
+        latest, previous = _get_samples()
+        if latest is None:
+            return ''
+        return str(latest['mem'].get('MemTotal', ''))
 
 
 def get_ip_addresses():
@@ -79,14 +180,11 @@ def get_ip_addresses():
 def get_uptime():
     controller_config = config.controller
     if controller_config['distribution_name'] != 'windows':
-        try:
-            with open("/proc/uptime", "rb") as fd:
-                out = fd.readline().split()
+        latest, previous = _get_samples()
+        if latest is None:
+            return "Cannot open /proc/stat"
 
-        except:
-            return "Cannot open /proc/uptime"
-
-        total_seconds = float(out[0])
+        total_seconds = time.time() - latest['boot_time']
 
         # Helper vars:
         MINUTE = 60
@@ -113,3 +211,146 @@ def get_uptime():
         string += str(seconds) + " " + (seconds == 1 and "second" or "seconds")
 
         return string
+
+
+class Ring(object):
+    """Preallocated buffer keeping the last size items."""
+
+    def __init__(self, size):
+        self.size = size
+        self.items = [None] * size
+        self.index = 0
+
+    def append(self, item):
+        self.items[self.index % self.size] = item
+        self.index += 1
+
+    def latest(self, back=0):
+        """Returns the last appended item, or the one appended back items
+        before it, or None."""
+        if back >= min(self.index, self.size):
+            return None
+        return self.items[(self.index - 1 - back) % self.size]
+
+
+def read_sample():
+    """Reads the kernel counters the host sensors are computed from."""
+    sample = {'time': time.time()}
+
+    with open('/proc/stat', 'rb') as fd:
+        for line in fd:
+            fields = line.split()
+            if fields[0] == 'cpu':
+                values = [int(value) for value in fields[1:]]
+                # Time spent idle or waiting for I/O
+                sample['cpu'] = (sum(values), sum(values[3:5]))
+            elif fields[0] == 'btime':
+                sample['boot_time'] = int(fields[1])
+
+    mem = {}
+    with open('/proc/meminfo', 'rb') as fd:
+        for line in fd:
+            fields = line.split()
+            mem[fields[0].rstrip(':')] = int(fields[1])
+    sample['mem'] = mem
+
+    with open('/proc/loadavg', 'rb') as fd:
+        sample['load'] = tuple(float(value) for value in fd.read().split()[:3])
+
+    disks = {}
+    with open('/proc/diskstats', 'rb') as fd:
+        for line in fd:
+            fields = line.split()
+            if fields[2].startswith(('loop', 'ram')):
+                continue
+            # Reads, sectors read, writes, sectors written
+            disks[fields[2]] = (int(fields[3]), int(fields[5]),
+                                int(fields[7]), int(fields[9]))
+    sample['disks'] = disks
+
+    net = {}
+    with open('/proc/net/dev', 'rb') as fd:
+        for line in fd.readlines()[2:]:
+            name, counters = line.split(':', 1)
+            fields = counters.split()
+            # Bytes and packets received, bytes and packets sent
+            net[name.strip()] = (int(fields[0]), int(fields[1]),
+                                 int(fields[8]), int(fields[9]))
+    sample['net'] = net
+
+    return sample
+
+
+class ProcSampler(threading.Thread):
+    """Reads the kernel counters at a fixed cadence, so that sensors are
+    answered from the latest samples without blocking."""
+
+    def __init__(self, interval=1, size=60):
+        threading.Thread.__init__(self, name="PROCSAMPLER")
+        self.daemon = True
+        self.interval = interval
+        self.samples = Ring(size)
+        self.running = True
+        self.samples.append(read_sample())
+
+    def run(self):
+        next_time = time.time()
+        while self.running:
+            next_time += self.interval
+            delay = next_time - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Don't try to catch up after a suspend
+                next_time = time.time()
+            try:
+                self.samples.append(read_sample())
+                self._record()
+            except (IOError, OSError, ValueError, IndexError) as err:
+                log.error("Could not read kernel counters (%s)" % err)
+
+    def _record(self):
+        latest = self.samples.latest()
+        previous = self.samples.latest(1)
+        timestamp = latest['time']
+        history.add('cpu', _get_cpu_percent(latest, previous), timestamp)
+        history.add('load', latest['load'][0], timestamp)
+        history.add('memory', _get_memory_percent(latest['mem']), timestamp)
+
+    def shutdown(self):
+        self.running = False
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def start_sampler():
+    """Starts the sampler if /proc is available. Returns it or None."""
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None and os.path.exists('/proc/stat'):
+            try:
+                _sampler = ProcSampler()
+                _sampler.start()
+            except (IOError, OSError, ValueError, IndexError) as err:
+                log.error("Could not start the host sampler (%s)" % err)
+                _sampler = None
+        return _sampler
+
+
+def stop_sampler():
+    global _sampler
+    with _sampler_lock:
+        if _sampler is not None:
+            _sampler.shutdown()
+            _sampler = None
+
+
+def _get_samples():
+    """Returns the latest and previous samples. The previous one is None
+    until the sampler took two samples."""
+    sampler = _sampler or start_sampler()
+    if sampler is None:
+        return None, None
+    return sampler.samples.latest(), sampler.samples.latest(1)
@@ -1,5 +1,6 @@
 from synapse.logger import logger
 from synapse.resources.resources import ResourcesController
+from synapse.synapse_exceptions import ResourceException
 from synapse.task import OutgoingMessage, AmqpTask
 
 
@@ -10,6 +11,12 @@ class HostsController(ResourcesController):
 
     __resource__ = "hosts"
 
+    def __init__(self, module):
+        super(HostsController, self).__init__(module)
+        # Sensors are answered from samples taken in the background
+        if hasattr(self.module, 'start_sampler'):
+            self.module.start_sampler()
+
     def read(self, res_id=None, attributes={}):
         sensors = attributes.keys()
 
@@ -34,9 +41,41 @@ class HostsController(ResourcesController):
             status['uptime'] = self.module.get_uptime()
         if 'cpu' in sensors:
             status['cpu'] = self.cpu()
+        if 'load' in sensors:
+            status['load'] = self.module.get_loadavg()
+        if 'memory' in sensors:
+            status['memory'] = self.module.get_memory()
+        if 'disks' in sensors:
+            status['disks'] = self.module.get_disk_rates()
+        if 'network' in sensors:
+            status['network'] = self.module.get_net_rates()
+
+        # {"cpu": {"window": 300}} asks for the min, avg and max of the cpu
+        # usage over the last 5 minutes instead of its current value.
+        for sensor in ('cpu', 'load', 'memory'):
+            window = self._get_window(attributes.get(sensor))
+            if window is not None:
+                status[sensor] = self._get_history(sensor, window)
 
         return status
 
+    def _get_window(self, value):
+        if not isinstance(value, dict) or 'window' not in value:
+            return None
+        try:
+            return max(1, int(value['window']))
+        except (TypeError, ValueError):
+            raise ResourceException("Invalid window: %s" % value['window'])
+
+    def _get_history(self, sensor, window):
+        history = None
+        if hasattr(self.module, 'get_history'):
+            history = self.module.get_history(sensor, window)
+        if history is None:
+            return None
+        history['window'] = window
+        return history
+
     def ping(self):
         result = self.read()
         msg = OutgoingMessage(collection=self.__resource__,
@@ -46,6 +85,30 @@ class HostsController(ResourcesController):
         task = AmqpTask(msg)
         self.publish(task)
 
-    def cpu(self):
+    def cpu(self, window=None):
+        if window:
+            return self._get_average('cpu', window)
         return self.module.get_cpu()
 
+    def load(self, window=None):
+        if window:
+            return self._get_average('load', window)
+        loadavg = self.module.get_loadavg()
+        return loadavg[0] if loadavg else 0
+
+    def memory(self, window=None):
+        if window:
+            return self._get_average('memory', window)
+        memory = self.module.get_memory()
+        return memory['used_percent'] if memory else 0
+
+    def _get_average(self, sensor, window):
+        # None until the window holds samples, so that alerts aren't
+        # evaluated against a made up value
+        history = self._get_history(sensor, window)
+        return round(history['avg'], 1) if history else None
+
+    def close(self):
+        super(HostsController, self).close()
+        if hasattr(self.module, 'stop_sampler'):
+            self.module.stop_sampler()
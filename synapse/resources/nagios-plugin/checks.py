@@ -0,0 +1,153 @@
+import time
+import zlib
+import threading
+
+from Queue import Queue
+
+from synapse.syncmd import exec_cmd
+from synapse.logger import logger
+
+
+def get_offset(name, interval):
+    """Returns a stable delay, within interval seconds, before the first run
+    of a check so that checks sharing an interval don't start together."""
+    if interval <= 0:
+        return 0
+    return (zlib.crc32(name) & 0xffffffff) % (interval * 1000) / 1000.
+
+
+def parse_output(stdout):
+    """Splits the output of a nagios plugin into its text and performance
+    data, which follow a '|' on the first line and on the long output."""
+    lines = stdout.strip().split('\n')
+    text, _, perfdata = lines[0].partition('|')
+    perfdata = [perfdata.strip()] if perfdata.strip() else []
+    long_text = []
+    in_perfdata = False
+    for line in lines[1:]:
+        if not in_perfdata and '|' in line:
+            line, _, more = line.partition('|')
+            long_text.append(line)
+            perfdata.append(more.strip())
+            in_perfdata = True
+        elif in_perfdata:
+            perfdata.append(line.strip())
+        else:
+            long_text.append(line)
+
+    output = '\n'.join([text.strip()] + long_text).strip()
+    return output, ' '.join(item for item in perfdata if item)
+
+
+class ResultStore(object):
+    """Latest result of each check."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results = {}
+
+    def set(self, name, result):
+        """Records an exec_cmd result, along with its parsed output and
+        perfdata and the time it was received."""
+        result = dict(result)
+        result['name'] = name
+        result['output'], result['perfdata'] = parse_output(result['stdout'])
+        result['timestamp'] = time.time()
+        with self._lock:
+            self._results[name] = result
+        return result
+
+    def get(self, name):
+        """Returns a copy of the latest result of a check with its age in
+        seconds, or None if the check didn't run yet."""
+        with self._lock:
+            result = self._results.get(name)
+        if result is None:
+            return None
+        result = dict(result)
+        result['age'] = max(0, time.time() - result['timestamp'])
+        return result
+
+    def discard(self, name):
+        with self._lock:
+            self._results.pop(name, None)
+
+
+@logger
+class CheckRunner(object):
+    """Runs nagios checks on a bounded number of threads. A check isn't
+    started again while its previous run is queued or running.
+
+    on_result(name, result) is called with the exec_cmd result of each run.
+    """
+
+    def __init__(self, on_result, max_checks=4, timeout=None):
+        self.on_result = on_result
+        self.timeout = timeout
+        self.queue = Queue()
+        self._lock = threading.Lock()
+
+        # Names of the checks queued or running
+        self._pending = set()
+
+        self._threads = []
+        for index in range(max(1, max_checks)):
+            thread = threading.Thread(target=self._work,
+                                      name="NAGIOS-%d" % index)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, name, command, timeout=None):
+        """Queues a run of command. Returns False if the previous run of the
+        check isn't over yet."""
+        with self._lock:
+            if name in self._pending:
+                self.logger.warning("Check %s is still running, skipping" %
+                                    name)
+                return False
+            self._pending.add(name)
+
+        self.queue.put((name, command, timeout or self.timeout))
+        return True
+
+    def run(self, name, command, timeout=None, overlap=False):
+        """Runs a check in the calling thread. Returns None if its previous
+        run isn't over yet, unless overlap is set."""
+        with self._lock:
+            running = name in self._pending
+            if running and not overlap:
+                return None
+            if not running:
+                self._pending.add(name)
+
+        try:
+            return exec_cmd(command, timeout=timeout or self.timeout)
+        finally:
+            if not running:
+                with self._lock:
+                    self._pending.discard(name)
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+
+            name, command, timeout = item
+            try:
+                result = exec_cmd(command, timeout=timeout)
+                if result['timed_out']:
+                    self.logger.warning("Check %s timed out after %ss" %
+                                        (name, timeout))
+                self.on_result(name, result)
+            except Exception as err:
+                self.logger.error("Could not run check %s (%s)" %
+                                  (name, err))
+            finally:
+                with self._lock:
+                    self._pending.discard(name)
+
+    def shutdown(self):
+        for thread in self._threads:
+            self.queue.put(None)
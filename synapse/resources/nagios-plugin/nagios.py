@@ -1,14 +1,14 @@
 import os
-from io import StringIO
 
-
-from ConfigParser import RawConfigParser
-from synapse.syncmd import exec_cmd
 from synapse.config import config
+from synapse.config_watcher import ConfigWatcher
 from synapse.logger import logger
-from synapse.scheduler import SynSched
+from synapse.scheduler import get_scheduler
 from synapse.resources.resources import ResourcesController
 from synapse.task import OutgoingMessage
+from synapse.synapse_exceptions import ResourceException
+
+from checks import CheckRunner, ResultStore, get_offset
 
 
 @logger
@@ -19,19 +19,58 @@ class NagiosPluginsController(ResourcesController):
     def __init__(self, module):
         super(NagiosPluginsController, self).__init__(module)
         self.path = self._configure()
+        self.configs = ConfigWatcher(self.path)
         self.plugins = {}
         self._load_configs()
-        self.scheduler = SynSched()
-        self.scheduler.start()
+        self.results = ResultStore()
+        self.checks = CheckRunner(self._handle_result,
+                                  max_checks=config.nagios['max_checks'],
+                                  timeout=config.nagios['check_timeout'])
+        self.scheduler = get_scheduler()
+
+        # check name -> (job id, check definition)
+        self.jobs = {}
+        # check name -> last warning logged about its definition
+        self.invalid = {}
         self._load_jobs()
-        self.scheduler.add_job(self._reload, 30)
+        self.reload_job = self.scheduler.add_job(self._reload, 30, delay=30)
+        self.scheduler.start()
 
     def read(self, res_id=None, attributes=None):
-        sensors = attributes.keys()
+        '''
+        Returns the latest scheduled result of the checks named in
+        attributes. A check is executed on the spot if it didn't run yet, if
+        its result is older than the max_age attribute (in seconds) or if
+        the force attribute is set. An expired result is only returned,
+        flagged as stale, while the check is already running.
+        '''
+        attributes = attributes or {}
+        force = attributes.get('force') in config.TRUE_ANSWERS
+        try:
+            max_age = attributes.get('max_age')
+            if max_age is not None:
+                max_age = float(max_age)
+        except ValueError:
+            raise ResourceException("max_age must be a number of seconds")
+
         status = {}
-        for sensor in sensors:
-            if sensor in self.plugins.keys():
-                status[sensor] = exec_cmd(self.plugins[sensor]['command'])
+        for sensor in attributes:
+            if sensor not in self.plugins:
+                continue
+
+            result = self.results.get(sensor)
+            expired = (result is not None and max_age is not None and
+                       result['age'] > max_age)
+            if result is None or force or expired:
+                plugin = self.plugins[sensor]
+                live = self.checks.run(sensor, plugin['command'],
+                                       self._get_timeout(plugin),
+                                       overlap=result is None or force)
+                if live is not None:
+                    result = self.results.set(sensor, live)
+                    result['age'] = 0
+            result['stale'] = max_age is not None and result['age'] > max_age
+            status[sensor] = result
 
         return status
 
@@ -42,53 +81,82 @@ class NagiosPluginsController(ResourcesController):
         return config_path
 
     def _reload(self):
-        self._load_configs()
-        self._load_jobs()
+        # Checks whose command didn't exist are tried again
+        if self._load_configs() or len(self.jobs) < len(self.plugins):
+            self._load_jobs()
 
     def _load_configs(self):
-        for conf_file in os.listdir(self.path):
-            if not conf_file.endswith('.conf'):
-                continue
-            full_path = os.path.join(self.path, conf_file)
-            conf = RawConfigParser()
-            conf.read(full_path)
-            for section in conf.sections():
-                if section not in self.plugins:
-                    self.plugins[section] = dict(conf.items(section))
-                    self.plugins[section]['scheduled'] = False
+        """Returns True if the checks definitions changed."""
+        if not self.configs.load():
+            return False
+        plugins = self.configs.sections
+        changed = plugins != self.plugins
+        self.plugins = plugins
+        return changed
 
     def _load_jobs(self):
+        # Unschedule the removed and modified checks
+        for key, (job_id, definition) in self.jobs.items():
+            if self.plugins.get(key) != definition:
+                self.scheduler.remove_job(job_id)
+                del self.jobs[key]
+            if key not in self.plugins:
+                self.results.discard(key)
+
+        for key in self.invalid.keys():
+            if key not in self.plugins:
+                del self.invalid[key]
+
         for key, value in self.plugins.iteritems():
-            if value['scheduled']:
+            if key in self.jobs:
                 continue
 
             try:
                 interval = int(value['interval'])
                 command = value['command']
                 if os.path.exists(command.split()[0]):
-                    self.scheduler.add_job(self._execute,
-                                           interval,
-                                           actionargs=(key, command))
-                    self.plugins[key]['scheduled'] = True
+                    job_id = self.scheduler.add_job(
+                        self._execute, interval, actionargs=(key, command),
+                        delay=get_offset(key, interval))
+                    self.jobs[key] = (job_id, value)
+                    self.invalid.pop(key, None)
                 else:
-                    self.logger.warning("%s doesn't exist" % command)
+                    self._warn(key, "%s doesn't exist" % command)
 
             except ValueError:
-                self.logger.warning("Interval value for %s must be an int" %
-                                    key)
+                self._warn(key, "Interval value for %s must be an int" % key)
             except KeyError as err:
-                self.logger.warning("Error when parsing %s (%s)" %
-                                    (self.path, key))
+                self._warn(key, "Error when parsing %s (%s)" %
+                           (self.path, key))
+
+    def _warn(self, key, message):
+        # Invalid checks are retried on every reload, only log the first
+        # failure and the ones that differ from it.
+        if self.invalid.get(key) != message:
+            self.invalid[key] = message
+            self.logger.warning(message)
+
+    def _get_timeout(self, plugin):
+        try:
+            return int(plugin['timeout'])
+        except (KeyError, ValueError):
+            return None
 
     def _execute(self, name, cmd):
-        result = exec_cmd(cmd)
+        plugin = self.plugins.get(name, {})
+        self.checks.submit(name, cmd, self._get_timeout(plugin))
+
+    def _handle_result(self, name, result):
+        result = self.results.set(name, result)
         if result['returncode'] != 0:
-            result['name'] = name
             msg = OutgoingMessage(collection=self.__resource__, status=result,
                                   msg_type='alert')
             self.publish(msg)
 
     def close(self):
         super(NagiosPluginsController, self).close()
-        self.logger.debug("Shutting down nagios scheduler")
-        self.scheduler.shutdown()
+        self.logger.debug("Removing nagios jobs")
+        self.scheduler.remove_job(self.reload_job)
+        for job_id, definition in self.jobs.itervalues():
+            self.scheduler.remove_job(job_id)
+        self.checks.shutdown()
@@ -1,6 +1,9 @@
 import os
+import time
 import logging
+import threading
 
+from synapse.config import config
 from synapse.syncmd import exec_cmd
 from synapse.synapse_exceptions import ResourceException
 
@@ -10,38 +13,120 @@ os.environ.update(env_vars)
 
 log = logging.getLogger('synapse')
 
+# dpkg doesn't wait for its lock, only run one apt-get at a time.
+_lock = threading.Lock()
+
+DPKG_STATUS = '/var/lib/dpkg/status'
+
+# Installed packages, parsed from the dpkg status file again only when it
+# changes.
+_inventory = {'key': None, 'packages': frozenset(), 'listing': None}
+_inventory_lock = threading.Lock()
+
+APT_LISTS = ('/var/lib/apt/lists', '/var/lib/apt/lists/partial',
+             '/var/lib/apt/periodic/update-success-stamp')
+APT_SOURCES = ('/etc/apt/sources.list', '/etc/apt/sources.list.d')
+
+# Time of the last successful index refresh run by the agent
+_last_refresh = [0]
+
+
 def install(name):
-    ret = exec_cmd("/usr/bin/apt-get -qy update")
-    ret = exec_cmd("/usr/bin/apt-get -qy install {0} --force-yes".format(name))
-    if not is_installed(name):
+    names = _get_names(name)
+    with _lock:
+        _refresh_index()
+        ret = exec_cmd(
+            "/usr/bin/apt-get -qy install {0} --force-yes".format(
+                ' '.join(names)))
+    if not all(is_installed(name) for name in names):
         raise ResourceException(ret['stderr'])
 
 
 def get_installed_packages():
-    ret = exec_cmd("/usr/bin/dpkg-query -l")
-    return ret['stdout'].split('\n')
+    with _inventory_lock:
+        key = _get_status_key()
+        if key is None or _inventory['listing'] is None or \
+                _inventory['listing'][0] != key:
+            ret = exec_cmd("/usr/bin/dpkg-query -l")
+            _inventory['listing'] = (key, ret['stdout'].split('\n'))
+        return _inventory['listing'][1]
 
 
 def remove(name):
-    ret = exec_cmd("/usr/bin/apt-get -qy remove {0} --force-yes".format(name))
+    with _lock:
+        ret = exec_cmd(
+            "/usr/bin/apt-get -qy remove {0} --force-yes".format(
+                ' '.join(_get_names(name))))
     if ret['returncode'] != 0:
         raise ResourceException(ret['stderr'])
 
 
 def update(name):
     if name:
-        ret = exec_cmd(
-            "/usr/bin/apt-get -quy install {0} --force-yes".format(name))
+        with _lock:
+            ret = exec_cmd(
+                "/usr/bin/apt-get -quy install {0} --force-yes".format(name))
         if ret['returncode'] != 0:
             raise ResourceException(ret['stderr'])
     else:
-        ret = exec_cmd("/usr/bin/apt-get -qy update")
-        ret = exec_cmd("/usr/bin/apt-get -qy upgrade --force-yes")
+        with _lock:
+            _refresh_index()
+            ret = exec_cmd("/usr/bin/apt-get -qy upgrade --force-yes")
         if ret['returncode'] != 0:
             raise ResourceException(ret['stderr'])
 
 
+def _refresh_index():
+    """Runs apt-get update if the package lists are older than index_ttl
+    seconds or if a source changed since they were refreshed."""
+    refreshed = max(_last_refresh[0], _get_newest_mtime(APT_LISTS))
+    if (time.time() - refreshed < config.packages['index_ttl'] and
+            _get_newest_mtime(APT_SOURCES, entries=True) < refreshed):
+        log.debug("Package lists are up to date")
+        return
+
+    ret = exec_cmd("/usr/bin/apt-get -qy update")
+    if ret['returncode'] == 0:
+        _last_refresh[0] = time.time()
+
+
+def _get_newest_mtime(paths, entries=False):
+    """Returns the newest modification time of paths, and of the files of
+    the directories among them if entries is True."""
+    newest = 0
+    for path in paths:
+        try:
+            newest = max(newest, os.stat(path).st_mtime)
+            names = os.listdir(path) if entries and os.path.isdir(path) else []
+        except OSError:
+            continue
+        for name in names:
+            try:
+                newest = max(newest,
+                             os.stat(os.path.join(path, name)).st_mtime)
+            except OSError:
+                pass
+    return newest
+
+
+def _get_names(name):
+    """Packages can be given as a list or as a space separated string."""
+    if isinstance(name, basestring):
+        return name.split()
+    return list(name)
+
+
 def is_installed(name):
+    packages = _get_inventory()
+
+    # Patterns and unreadable status files are left to dpkg-query
+    if packages is None or any(c in name for c in '*?[]='):
+        return _query_installed(name)
+
+    return name in packages
+
+
+def _query_installed(name):
     ret = exec_cmd("/usr/bin/dpkg-query -l '{0}'".format(name))
     if ret['returncode'] != 0:
         return False
@@ -58,3 +143,53 @@ def is_installed(name):
     except IndexError as err:
         log.error(err)
         return False
+
+
+def _get_status_key():
+    try:
+        si = os.stat(DPKG_STATUS)
+    except OSError:
+        return None
+    return (si.st_ino, si.st_size, si.st_mtime)
+
+
+def _get_inventory():
+    """Returns the set of installed packages names, with and without their
+    architecture, or None if the dpkg status file can't be read."""
+    with _inventory_lock:
+        key = _get_status_key()
+        if key is None:
+            return None
+        if _inventory['key'] != key:
+            try:
+                _inventory['packages'] = _parse_status(DPKG_STATUS)
+            except IOError as err:
+                log.error(err)
+                return None
+            _inventory['key'] = key
+        return _inventory['packages']
+
+
+def _parse_status(path):
+    packages = set()
+    fields = {}
+    with open(path) as fd:
+        for line in fd:
+            if not line.strip():
+                _add_package(packages, fields)
+                fields = {}
+            elif not line[0].isspace() and ':' in line:
+                field, value = line.split(':', 1)
+                if field in ('Package', 'Status', 'Architecture'):
+                    fields[field] = value.strip()
+    _add_package(packages, fields)
+    return frozenset(packages)
+
+
+def _add_package(packages, fields):
+    name = fields.get('Package')
+    status = fields.get('Status', '').split()
+    if name and status[-1:] == ['installed']:
+        packages.add(name)
+        if fields.get('Architecture'):
+            packages.add('%s:%s' % (name, fields['Architecture']))
@@ -1,17 +1,29 @@
+import re
+
 from synapse.resources.resources import ResourcesController
+from synapse.config import config
 from synapse.logger import logger
 
+from transactions import TransactionCoalescer
+
 
 @logger
 class PackagesController(ResourcesController):
 
     __resource__ = "packages"
 
+    def __init__(self, module):
+        super(PackagesController, self).__init__(module)
+        self.transactions = TransactionCoalescer(
+            self._run_transaction, config.packages['batch_window'])
+
     def read(self, res_id=None, attributes=None):
         status = {}
 
         if res_id:
-            status['installed'] = self.module.is_installed(res_id)
+            names = self._get_names(res_id)
+            status['installed'] = all(self.module.is_installed(name)
+                                      for name in names)
         else:
             status['installed'] = self.module.get_installed_packages()
 
@@ -24,8 +36,10 @@ class PackagesController(ResourcesController):
         state = {'installed': True}
         self.save_state(res_id, state, monitor=monitor)
 
-        if not self.module.is_installed(res_id):
-            self.module.install(res_id)
+        missing = [name for name in self._get_names(res_id)
+                   if not self.module.is_installed(name)]
+        if missing:
+            self._apply('install', missing)
 
         return self.read(res_id)
 
@@ -36,7 +50,7 @@ class PackagesController(ResourcesController):
         state = {'installed': True}
         self.save_state(res_id, state, monitor=monitor)
 
-        self.module.update(res_id)
+        self.module.update(' '.join(self._get_names(res_id)))
 
         return self.read(res_id)
 
@@ -47,8 +61,10 @@ class PackagesController(ResourcesController):
         state = {'installed': False}
         self.save_state(res_id, state, monitor=monitor)
 
-        if self.module.is_installed(res_id):
-            self.module.remove(res_id)
+        installed = [name for name in self._get_names(res_id)
+                     if self.module.is_installed(name)]
+        if installed:
+            self._apply('remove', installed)
 
         return self.read(res_id)
 
@@ -58,3 +74,32 @@ class PackagesController(ResourcesController):
                 return False
 
         return True
+
+    def _get_names(self, res_id):
+        """A resource id can hold several packages names, separated by
+        commas or spaces."""
+        return [name for name in re.split(r'[,\s]+', res_id) if name]
+
+    def _run_transaction(self, action, names):
+        getattr(self.module, action)(names)
+
+    def _apply(self, action, names):
+        """Installs or removes packages along with the packages requested
+        meanwhile by other tasks. Raises an error if the requested ones
+        didn't end up in the expected state."""
+        batch, error = self.transactions.submit(action, names)
+        if error is None:
+            return
+
+        expected = action == 'install'
+        failed = [name for name in names
+                  if self.module.is_installed(name) != expected]
+        if not failed:
+            return
+
+        # Other packages of the transaction may have caused the failure, try
+        # again with the requested packages only to get their own error.
+        if set(batch) - set(names):
+            self.transactions.run_alone(action, failed)
+        else:
+            raise error
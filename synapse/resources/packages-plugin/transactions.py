@@ -0,0 +1,90 @@
+import time
+import threading
+
+from synapse.logger import logger
+
+
+class _Batch(object):
+
+    def __init__(self):
+        self.names = set()
+        self.done = threading.Event()
+        self.error = None
+
+
+@logger
+class TransactionCoalescer(object):
+    """Gathers the packages operations submitted by concurrent requests
+    and runs each kind of operation as a single transaction.
+
+    run(action, names) is called once per batch by the thread that opened
+    it, the other submitters wait for its outcome. Transactions run one at a
+    time and a batch keeps gathering names until its turn comes. A lone
+    submission runs right away, the window only delays the batches opened
+    while other submissions are in flight.
+
+    Submitters block until their transaction ran, so a batch gathers at
+    most as many requests as there are controller workers.
+    """
+
+    def __init__(self, run, window=0):
+        self.run = run
+        self.window = window
+        self._lock = threading.Lock()
+
+        # Package managers run one transaction at a time
+        self._run_lock = threading.Lock()
+
+        # action -> batch being gathered
+        self._batches = {}
+
+        # Number of batches opened and not run yet
+        self._in_flight = 0
+
+    def submit(self, action, names):
+        """Runs action on names along with the names submitted for the same
+        action meanwhile. Returns the names of the whole transaction and the
+        exception it raised, if any.
+        """
+        with self._lock:
+            batch = self._batches.get(action)
+            opened = batch is None
+            if opened:
+                batch = self._batches[action] = _Batch()
+                busy = self._in_flight > 0
+                self._in_flight += 1
+            batch.names.update(names)
+
+        if not opened:
+            batch.done.wait()
+            return batch.names, batch.error
+
+        # Part of a burst, give the rest of it time to join
+        if busy and self.window > 0:
+            time.sleep(self.window)
+
+        # The batch keeps gathering names while another transaction runs
+        try:
+            with self._run_lock:
+                with self._lock:
+                    del self._batches[action]
+
+                try:
+                    names = sorted(batch.names)
+                    self.logger.debug("Running %s transaction for %s" %
+                                      (action, ', '.join(names)))
+                    self.run(action, names)
+                except Exception as err:
+                    batch.error = err
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            batch.done.set()
+
+        return batch.names, batch.error
+
+    def run_alone(self, action, names):
+        """Runs action on names only, once the running transaction is over.
+        Exceptions are raised to the caller."""
+        with self._run_lock:
+            self.run(action, names)
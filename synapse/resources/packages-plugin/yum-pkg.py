@@ -1,41 +1,133 @@
+import os
+import threading
+
 from synapse.syncmd import exec_cmd
 from synapse.synapse_exceptions import ResourceException
 from synapse.logger import logger
 
 log = logger('yum-pkg')
 
+# Only run one yum transaction at a time instead of piling up processes
+# waiting for the yum lock.
+_lock = threading.Lock()
+
+RPMDB_PATHS = ('/var/lib/rpm', '/usr/lib/sysimage/rpm')
+
+# Installed packages, queried again from the rpm database only when one of
+# its files changes.
+_inventory = {'key': None, 'packages': frozenset(), 'listing': []}
+_inventory_lock = threading.Lock()
+
 
 def install(name):
-    ret = exec_cmd("/usr/bin/yum -q -y install %s" % name)
+    with _lock:
+        ret = exec_cmd("/usr/bin/yum -q -y install %s" %
+                       ' '.join(_get_names(name)))
     if ret['returncode'] != 0:
         raise ResourceException(ret['stderr'])
 
 
 def get_installed_packages():
-    ret = exec_cmd("/bin/rpm -qa")
-    return ret['stdout'].split('\n')
+    if _get_inventory() is None:
+        ret = exec_cmd("/bin/rpm -qa")
+        return ret['stdout'].split('\n')
+    return list(_inventory['listing'])
 
 
 def remove(name):
-    ret = exec_cmd("/usr/bin/yum -q -y remove %s" % name)
+    with _lock:
+        ret = exec_cmd("/usr/bin/yum -q -y remove %s" %
+                       ' '.join(_get_names(name)))
     if ret['returncode'] != 0:
         raise ResourceException(ret['stderr'])
 
 
 def update(name):
-    # We need to check first if the package is installed. yum update of a
+    # We need to check first if the packages are installed. yum update of a
     # non-existing package has a returncode of 0. We need to raise an exception
-    # if the package is not installed !
-    inst = is_installed(name)
-    ret = exec_cmd("/usr/bin/yum -q -y update %s" % name)
+    # if a package is not installed !
+    names = _get_names(name)
+    installed = [n for n in names if is_installed(n)]
+    missing = [n for n in names if n not in installed]
 
-    if ret['returncode'] != 0 or not inst:
-        raise ResourceException(ret['stderr'])
+    if installed or not names:
+        with _lock:
+            ret = exec_cmd("/usr/bin/yum -q -y update %s" %
+                           ' '.join(installed))
+        if ret['returncode'] != 0:
+            raise ResourceException(ret['stderr'])
+
+    if missing:
+        raise ResourceException("Not installed: %s" % ' '.join(missing))
+
+
+def _get_names(name):
+    """Packages can be given as a list or as a space separated string."""
+    if isinstance(name, basestring):
+        return name.split()
+    return list(name)
 
 
 def is_installed(name):
     if name:
-        ret = exec_cmd("/bin/rpm -q %s" % name)
-        return ret['returncode'] == 0
+        packages = _get_inventory()
+
+        # Patterns and epochs are left to rpm
+        if packages is None or any(c in name for c in '*?[]:'):
+            ret = exec_cmd("/bin/rpm -q %s" % name)
+            return ret['returncode'] == 0
+
+        return name in packages
     else:
         return get_installed_packages()
+
+
+def _get_rpmdb_key():
+    key = []
+    for path in sorted(set(os.path.realpath(p) for p in RPMDB_PATHS)):
+        try:
+            names = os.listdir(path)
+        except OSError:
+            continue
+        for name in sorted(names):
+            try:
+                si = os.stat(os.path.join(path, name))
+            except OSError:
+                continue
+            key.append((name, si.st_ino, si.st_size, si.st_mtime))
+    return tuple(key) or None
+
+
+def _get_inventory():
+    """Returns the set of the names under which installed packages can be
+    queried, or None if the rpm database can't be found."""
+    with _inventory_lock:
+        key = _get_rpmdb_key()
+        if key is None:
+            return None
+        if _inventory['key'] != key:
+            ret = exec_cmd("/bin/rpm -qa --qf "
+                           "'%{NAME} %{VERSION} %{RELEASE} %{ARCH};'")
+            if ret['returncode'] != 0:
+                log.error(ret['stderr'])
+                return None
+            _inventory['packages'], _inventory['listing'] = \
+                _parse_query(ret['stdout'])
+            _inventory['key'] = key
+        return _inventory['packages']
+
+
+def _parse_query(output):
+    packages = set()
+    listing = []
+    for entry in output.split(';'):
+        try:
+            name, version, release, arch = entry.split()
+        except ValueError:
+            continue
+        nvr = '%s-%s-%s' % (name, version, release)
+        listing.append('%s.%s' % (nvr, arch))
+        packages.update((name, '%s.%s' % (name, arch),
+                         '%s-%s' % (name, version), nvr,
+                         '%s.%s' % (nvr, arch)))
+    return frozenset(packages), listing
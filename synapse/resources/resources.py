@@ -1,6 +1,7 @@
 import sys
 import traceback
 import time
+import threading
 from datetime import datetime, timedelta
 
 
@@ -17,6 +18,14 @@ class ResourcesController(object):
     """
     __resource__ = ""
 
+    # Set this to True if the resource can't be modified concurrently, even
+    # for different resource ids.
+    __exclusive__ = False
+
+    # Set this to True if resource ids are paths whose changes can be
+    # watched by the file watcher instead of being polled.
+    __watchable__ = False
+
     action_map = {'create': 'Creating',
                   'read'  : 'Reading',
                   'update': 'Updating',
@@ -28,20 +37,47 @@ class ResourcesController(object):
         alert_interval = config.compliance['alert_interval']
         self.alert_interval = timedelta(seconds=alert_interval)
 
+        # The controller processes tasks concurrently, keep per-request
+        # attributes local to the processing thread.
+        self._local = threading.local()
+
         self.module = module
         self.res_id = None
         self.states_manager = StatesManager(self.__resource__)
-        self.states = self.states_manager.states
 
         # This queue is injected by the resource locator at plugin
         # instantiation
         self.publish_queue = None
 
+        # The file watcher is injected by the controller if enabled
+        self.watcher = None
+
         self.response = {}
 
         # Use this lock to avoid unconsistent reads among threads, especially
-        # the compliance/monitor one.
-        self._lock = False
+        # the compliance/monitor one. It counts the requests being processed.
+        self._lock = 0
+        self._lock_guard = threading.Lock()
+
+    @property
+    def states(self):
+        return self.states_manager.states
+
+    @property
+    def res_id(self):
+        return getattr(self._local, 'res_id', None)
+
+    @res_id.setter
+    def res_id(self, value):
+        self._local.res_id = value
+
+    @property
+    def response(self):
+        return getattr(self._local, 'response', {})
+
+    @response.setter
+    def response(self, value):
+        self._local.response = value
 
     def _fmt_attrs(self, attrs):
         res = ''
@@ -78,7 +114,8 @@ class ResourcesController(object):
 
         self.logger.info(msg)
 
-        self._lock = True
+        with self._lock_guard:
+            self._lock += 1
         self.response = self.set_response()
         try:
             result = getattr(self, action)(res_id=self.res_id,
@@ -98,7 +135,7 @@ class ResourcesController(object):
                              (self.__resource__.upper(),
                               action.capitalize(),
                               self.res_id,
-                              self.response['error'].rstrip('\n')))
+                              ('%s' % err).rstrip('\n')))
 
         except Exception as err:
             self.response = self.set_response(error='%s' % err)
@@ -107,9 +144,10 @@ class ResourcesController(object):
                              (self.__resource__.upper(),
                               action.capitalize(),
                               self.res_id,
-                              self.response['error'].rstrip('\n')))
+                              ('%s' % err).rstrip('\n')))
         finally:
-            self._lock = False
+            with self._lock_guard:
+                self._lock -= 1
 
         # Copy the value to return
         response = self.response
@@ -146,39 +184,67 @@ class ResourcesController(object):
 
     def save_state(self, res_id, state={}, monitor=True):
         self.states_manager.save_state(res_id, state, monitor)
+        if self.watcher:
+            if monitor is False:
+                self.watcher.unwatch(self, res_id)
+            else:
+                self.watcher.watch(self, res_id)
 
     def check_compliance(self):
         if self._lock:
             return
 
-        for state in self.states:
-            if not state['compliant'] or state['back_to_compliance']:
-                self.publish_compliance(state)
+        with self.states_manager.sweep():
+            for state in self.states:
+                if not state['compliant'] or state['back_to_compliance']:
+                    self.publish_compliance(state)
 
     def monitor_states(self):
         if self._lock:
             return
 
-        for state in self.states:
-            # Get expected and current states
-            expected = state['status']
-            res_id = state['resource_id']
-            current = self.read(res_id)
+        with self.states_manager.sweep():
+            for state in self.states:
+                self._monitor_state(state)
+
+    def monitor_state(self, res_id):
+        """Checks the compliance of a single resource, e.g. when the file
+        watcher notices a change. Returns False if the check has to be done
+        later because a request is being processed.
+        """
+        if self._lock:
+            return False
+
+        state = self.states_manager.get_state(res_id)
+        if state:
+            with self.states_manager.sweep():
+                was_compliant = state['compliant']
+                self._monitor_state(state)
+
+                # Don't wait for the next compliance check to report it
+                if state['compliant'] != was_compliant:
+                    self.publish_compliance(state)
+
+        return True
 
-            # Update current status
-            state['current_status'] = current
+    def _monitor_state(self, state):
+        # Get expected and current states
+        expected = state['status']
+        res_id = state['resource_id']
+        current = self.read(res_id)
 
-            # Update compliance infos
-            was_compliant = state['compliant']
-            is_compliant = self.is_compliant(expected, current)
+        # Update current status
+        state['current_status'] = current
 
-            state['compliant'] = is_compliant
-            state['back_to_compliance'] = not was_compliant and is_compliant
+        # Update compliance infos
+        was_compliant = state['compliant']
+        is_compliant = self.is_compliant(expected, current)
 
-            now = datetime.now()
+        state['compliant'] = is_compliant
+        state['back_to_compliance'] = not was_compliant and is_compliant
 
-            # Persist states on disk.
-            self.states_manager.persist()
+        # Persist state on disk at the end of the sweep if it changed.
+        self.states_manager.persist(res_id)
 
     def publish(self, message):
         if self.publish_queue:
@@ -221,4 +287,4 @@ class ResourcesController(object):
             msg = OutgoingMessage(**state)
             self.publish(msg)
 
-        self.states_manager.persist()
+        self.states_manager.persist(state['resource_id'])
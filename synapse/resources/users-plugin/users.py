@@ -9,6 +9,10 @@ class UsersController(ResourcesController):
 
     __resource__ = "users"
 
+    # useradd, groupadd and friends fail instead of waiting when the
+    # passwd/group files are locked.
+    __exclusive__ = True
+
     def read(self, res_id=None, attributes=None):
         return self.module.get_user_infos(res_id)
 
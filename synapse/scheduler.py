@@ -1,64 +1,242 @@
 import time
-import sched
-
+import heapq
+import random
+import select
+import itertools
 import threading
 
-from synapse.config import config
 from synapse.logger import logger
+from synapse.wakeup import get_wakeup
+
+
+# Missed runs policies, applied when a job couldn't run on time (e.g. the
+# scheduler was busy or the system was suspended).
+SKIP = 'skip'
+CATCHUP = 'catchup'
+
+
+class Job(object):
+
+    def __init__(self, job_id, action, interval, actionargs=(), jitter=0,
+                 missed=SKIP):
+        if missed not in (SKIP, CATCHUP):
+            raise ValueError("Unknown missed runs policy: %s" % missed)
+        self.id = job_id
+        self.action = action
+        self.interval = interval
+        self.actionargs = tuple(actionargs)
+        self.jitter = jitter
+        self.missed = missed
+
+        # Nominal time of the next run, the actual one adds a random jitter
+        self.next_run = None
+
+        # Heap entries of previous schedulings are ignored
+        self.generation = 0
+
+    def __repr__(self):
+        return "<Job %s every %ss>" % (self.id, self.interval)
+
+
+def get_job_id(action, actionargs=()):
+    """Returns the id of a job from its action and arguments, which is the
+    same every time the job is added."""
+    name = getattr(action, '__name__', repr(action))
+    owner = getattr(action, '__self__', None)
+    if owner is not None:
+        name = '%s.%s' % (owner.__class__.__name__, name)
+    if actionargs:
+        name += '(%s)' % ', '.join(getattr(arg, '__name__', repr(arg))
+                                   for arg in actionargs)
+    return name
 
 
 @logger
 class SynSched(threading.Thread):
+    """Runs periodic jobs in a single thread.
+
+    Jobs are indexed by id and their runs are kept in a heap ordered by
+    time. The thread sleeps until the next run is due or until the jobs
+    change.
+    """
+
     def __init__(self):
         self.logger.debug("Initializing the scheduler...")
         threading.Thread.__init__(self, name="SCHEDULER")
 
-        # Start the scheduler
-        self.scheduler = sched.scheduler(time.time, lambda x: time.sleep(.1))
+        self._cond = threading.Condition()
+        # Python 2 timed Condition.wait polls every few milliseconds, the
+        # thread rather sleeps in select until the next run or a change of
+        # the jobs. Condition.wait is only used without pollable pipes.
+        self._wakeup = get_wakeup()
+        self._jobs = {}
+        self._heap = []
+        self._sequence = itertools.count()
+        self._started = False
+        self._running = True
+
+    def start(self):
+        """Starts the scheduler thread unless it's already started."""
+        with self._cond:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread.start(self)
+
+    @property
+    def running(self):
+        return self._running
 
     def run(self):
-        self.scheduler.run()
         self.logger.debug("Scheduler started...")
+        while True:
+            with self._cond:
+                job = self._wait_next_job()
+                if job is None:
+                    break
 
-    def add_job(self, job, interval, actionargs=()):
-        self.logger.debug("Adding job '%s' to scheduler every %d seconds" %
-                          (job, interval))
-        self._periodic(self.scheduler, interval, job, actionargs=actionargs)
-
-    def update_job(self, job, interval, actionargs=()):
-        job_name = actionargs[0].__name__
-        existing_job = self.get_job(job_name)
-        if existing_job is None:
-            self.add_job(job, interval, actionargs)
-        elif (interval != existing_job.argument[1] or
-              actionargs != existing_job.argument[3]):
-                self.scheduler.cancel(existing_job)
-                self.add_job(job, interval, actionargs)
-
-    def get_job(self, job_name):
-        job = None
-        for event in self.scheduler.queue:
-            if len(event.argument[3]):
-                if job_name == event.argument[3][0].__name__:
-                    job = event
-            else:
-                if job_name == event.argument[2].__name__:
-                    job = event
-
-        return job
-
-    def _periodic(self, scheduler, interval, action, actionargs=()):
-        args = (scheduler, interval, action, actionargs)
-        scheduler.enter(interval, 1, self._periodic, args)
+            try:
+                job.action(*job.actionargs)
+            except NotImplementedError:
+                pass
+            except Exception as err:
+                self.logger.error("Could not run job '%s' (%s)", job.id, err)
+
+            with self._cond:
+                if self._jobs.get(job.id) is job:
+                    self._reschedule(job)
+
+        if self._wakeup is not None:
+            with self._cond:
+                self._wakeup.close()
+        self.logger.debug("Scheduler stopped...")
+
+    def _wait_next_job(self):
+        while self._running:
+            while self._heap:
+                run_at, seq, job, generation = self._heap[0]
+                if (self._jobs.get(job.id) is job and
+                        job.generation == generation):
+                    break
+                # The job was removed or rescheduled meanwhile
+                heapq.heappop(self._heap)
+
+            if not self._heap:
+                self._wait()
+                continue
+
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                self._wait(delay)
+                continue
+
+            return heapq.heappop(self._heap)[2]
+
+    def _wait(self, timeout=None):
+        """Waits for a notification or the timeout. Must be called with the
+        lock held, like Condition.wait."""
+        if self._wakeup is None:
+            self._cond.wait(timeout)
+            return
+
+        self._cond.release()
         try:
-            action(*actionargs)
-        except NotImplementedError:
+            select.select([self._wakeup], [], [], timeout)
+        except select.error:
+            # Interrupted by a signal
             pass
-        except Exception as err:
-            self.logger.error("Could not run job \'%s\' (%s)", action, err)
+        finally:
+            self._cond.acquire()
+        self._wakeup.clear()
+
+    def _notify(self):
+        self._cond.notify()
+        if self._wakeup is not None:
+            self._wakeup.notify()
+
+    def _push(self, job, run_at):
+        job.next_run = run_at
+        job.generation += 1
+        if job.jitter:
+            run_at += random.uniform(0, job.jitter)
+        heapq.heappush(self._heap, (run_at, next(self._sequence), job,
+                                    job.generation))
+        self._notify()
+
+    def _reschedule(self, job):
+        next_run = job.next_run + job.interval
+        now = time.time()
+        if job.missed == SKIP and next_run <= now:
+            # Forget the missed runs, keep the same phase
+            missed = int((now - next_run) // job.interval) + 1
+            next_run += missed * job.interval
+        self._push(job, next_run)
+
+    def add_job(self, job, interval, actionargs=(), delay=None, job_id=None,
+                jitter=0, missed=SKIP):
+        """Runs job every interval seconds, starting now or after delay
+        seconds. A job added with the id of an existing one replaces it.
+        The id is derived from the job and its arguments if not given.
+
+        Each run is delayed by up to jitter random seconds. Runs missed while
+        the scheduler was busy are skipped or run in a row, depending on the
+        missed policy (SKIP or CATCHUP).
+
+        Returns the job id.
+        """
+        if job_id is None:
+            job_id = get_job_id(job, actionargs)
+        self.logger.debug("Adding job '%s' to scheduler every %d seconds" %
+                          (job_id, interval))
+
+        entry = Job(job_id, job, interval, actionargs, jitter, missed)
+        with self._cond:
+            self._jobs[job_id] = entry
+            self._push(entry, time.time() + (delay or 0))
+        return job_id
+
+    def update_job(self, job, interval, actionargs=(), job_id=None,
+                   **kwargs):
+        """Adds a job, or reschedules it if its interval or arguments
+        changed. Returns the job id."""
+        if job_id is None:
+            job_id = get_job_id(job, actionargs)
+        existing = self.get_job(job_id)
+        if (existing is not None and existing.interval == interval and
+                existing.actionargs == tuple(actionargs)):
+            return job_id
+        return self.add_job(job, interval, actionargs, job_id=job_id,
+                            **kwargs)
+
+    def get_job(self, job_id):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def remove_job(self, job_id):
+        """Removes a job. Returns False if there's no such job."""
+        with self._cond:
+            job = self._jobs.pop(job_id, None)
+            self._notify()
+        return job is not None
 
     def shutdown(self):
         """Shuts down the scheduler."""
-        self.logger.debug("Canceling scheduled events")
-        for event in self.scheduler.queue:
-            self.scheduler.cancel(event)
+        self.logger.debug("Canceling scheduled jobs")
+        with self._cond:
+            self._running = False
+            self._jobs.clear()
+            self._heap = []
+            self._notify()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Returns the scheduler shared by the whole agent."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None or not _scheduler.running:
+            _scheduler = SynSched()
+        return _scheduler
@@ -1,7 +1,11 @@
 import os, stat
+import copy
 import pickle
-from pickle import PicklingError, PickleError
-from operator import itemgetter
+import tempfile
+import threading
+from contextlib import contextmanager
+from pickle import PicklingError, PickleError, UnpicklingError
+from collections import OrderedDict
 
 from synapse.synapse_exceptions import SynapseException
 from synapse.config import config
@@ -10,6 +14,20 @@ from synapse.logger import logger
 
 @logger
 class StatesManager(object):
+    """Keeps the expected states of a resource, indexed by resource id.
+
+    States are persisted in two files: a snapshot holding every state and a
+    journal to which each changed state is appended. The journal is merged
+    into the snapshot when it grows too large, at load time and at shutdown.
+
+    Changes made during a sweep are gathered and written at once when the
+    sweep ends.
+    """
+
+    # Merge the journal into the snapshot once it holds this many records
+    # more than there are states.
+    COMPACT_THRESHOLD = 100
+
     def __init__(self, resource_name):
         self.resource_name = resource_name
 
@@ -20,11 +38,34 @@ class StatesManager(object):
         if not os.path.exists(folder):
             raise Exception('Persistence folder does not exist.')
 
-        # Filename for this resource state manager
+        # Filenames for this resource state manager
+        self.folder = folder
         self.path = os.path.join(folder, resource_name + '.pkl')
+        self.journal_path = os.path.join(folder, resource_name + '.journal')
+
+        # States can be saved by several controller workers at once
+        self._lock = threading.RLock()
+
+        # States as they were last written on disk, to only write changes
+        self._persisted = {}
+        self._journal_records = 0
+
+        # Resource ids persisted during the current thread's sweep
+        self._sweep = threading.local()
 
         # Load states in memory
-        self.states = self._load_from_file(self.path)
+        self._states = self._load_from_file(self.path)
+        self._replay_journal(self.journal_path)
+        for res_id, state in self._states.iteritems():
+            self._persisted[res_id] = copy.deepcopy(state)
+
+        if self._journal_records:
+            self.compact()
+
+    @property
+    def states(self):
+        with self._lock:
+            return self._states.values()
 
     def _load_from_file(self, path):
         states = []
@@ -40,23 +81,132 @@ class StatesManager(object):
         self.logger.debug("Loading %d persisted resources states from %s" %
                           (len(states), path))
 
-        return states
+        return OrderedDict((state['resource_id'], state) for state in states)
 
-    def persist(self):
+    def _replay_journal(self, path):
+        try:
+            with open(path, 'rb') as fd:
+                while True:
+                    res_id, state = pickle.load(fd)
+                    if state is None:
+                        self._states.pop(res_id, None)
+                    else:
+                        self._states[res_id] = state
+                    self._journal_records += 1
+        except (IOError, EOFError):
+            pass
+        except (UnpicklingError, ValueError, TypeError), err:
+            # The last record has been partially written
+            self.logger.warning("Truncated states journal %s (%s)" %
+                                (path, err))
+
+    @contextmanager
+    def sweep(self):
+        """Defers the states persisted by the current thread until the
+        outermost sweep ends. Only the states that actually changed are then
+        written, in a single journal write.
+        """
+        depth = getattr(self._sweep, 'depth', 0)
+        if not depth:
+            self._sweep.dirty = OrderedDict()
+        self._sweep.depth = depth + 1
         try:
-            with open(self.path, 'wb') as fd:
-                os.chmod(self.path, stat.S_IREAD | stat.S_IWRITE)
-                pickle.dump(self.states, fd)
+            yield
+        finally:
+            self._sweep.depth = depth
+            if not depth:
+                dirty = self._sweep.dirty
+                self._sweep.dirty = None
+                with self._lock:
+                    if None in dirty:
+                        dirty = self._states.keys() + self._persisted.keys()
+                    self._write_journal(self._get_changes(dirty))
+
+    def persist(self, res_id=None):
+        """Appends the states that changed since they were last persisted
+        to the journal. Only checks the given resource if res_id is set.
+        """
+        if getattr(self._sweep, 'depth', 0):
+            self._sweep.dirty[res_id] = True
+            return
+
+        with self._lock:
+            if res_id is None:
+                changed = self._get_changes(self._states.keys() +
+                                            self._persisted.keys())
+            else:
+                changed = self._get_changes([res_id])
+            self._write_journal(changed)
+
+    def _get_changes(self, res_ids):
+        changed = OrderedDict()
+        for res_id in res_ids:
+            state = self._states.get(res_id)
+            if state != self._persisted.get(res_id):
+                changed[res_id] = state
+        return changed.items()
+
+    def _write_journal(self, records):
+        if not records:
+            return
+        data = ''.join(pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+                       for record in records)
+        try:
+            with open(self.journal_path, 'ab') as fd:
+                os.chmod(self.journal_path, stat.S_IREAD | stat.S_IWRITE)
+                fd.write(data)
         except IOError as err:
             self.logger.error(err)
+            return
+
+        for res_id, state in records:
+            if state is None:
+                self._persisted.pop(res_id, None)
+            else:
+                self._persisted[res_id] = copy.deepcopy(state)
+        self._journal_records += len(records)
+
+        if (self._journal_records >
+                len(self._states) + self.COMPACT_THRESHOLD):
+            self.compact()
+
+    def compact(self):
+        """Atomically writes all states in the snapshot file then empties the
+        journal.
+        """
+        with self._lock:
+            try:
+                fd, tmp_path = tempfile.mkstemp(dir=self.folder,
+                                                prefix=self.resource_name)
+                with os.fdopen(fd, 'wb') as tmp:
+                    pickle.dump(self._states.values(), tmp)
+                    tmp.flush()
+                    os.fsync(tmp.fileno())
+                if os.name == 'nt' and os.path.exists(self.path):
+                    os.remove(self.path)
+                os.rename(tmp_path, self.path)
+                open(self.journal_path, 'wb').close()
+            except (IOError, OSError) as err:
+                self.logger.error(err)
+                return
+
+            self._persisted = dict((res_id, copy.deepcopy(state))
+                                   for res_id, state
+                                   in self._states.iteritems())
+            self._journal_records = 0
 
     def shutdown(self):
-        for state in self.states:
-            if 'last_alert' in state:
-                state['last_alert'] = None
-        self.persist()
+        with self._lock:
+            for state in self._states.itervalues():
+                if 'last_alert' in state:
+                    state['last_alert'] = None
+            self.compact()
 
     def save_state(self, res_id, state, monitor):
+        with self._lock:
+            self._save_state(res_id, state, monitor)
+
+    def _save_state(self, res_id, state, monitor):
         if monitor is False:
             self._remove_state(res_id)
 
@@ -71,28 +221,19 @@ class StatesManager(object):
             }
 
             self._update_state(item)
-        self.persist()
+        self.persist(res_id)
 
     def _update_state(self, state):
-        index = self._get_index(state['resource_id'])
-        if index != -1:
-            state['back_to_compliance'] = not self.states[index]['compliant']
-            self.states[index].update(state)
+        current = self._states.get(state['resource_id'])
+        if current is not None:
+            state['back_to_compliance'] = not current['compliant']
+            current.update(state)
         else:
-            self.states.append(state)
+            self._states[state['resource_id']] = state
 
     def _remove_state(self, res_id):
-        index = self._get_index(res_id)
-        if index != -1:
-            del self.states[index]
-
-    def _get_index(self, res_id):
-        try:
-            return map(itemgetter('resource_id'), self.states).index(res_id)
-        except ValueError:
-            return -1
+        self._states.pop(res_id, None)
 
-    def _get_state(self, res_id):
-        index = self._get_index(res_id)
-        return self.states[index] if index != -1 else {}
+    def get_state(self, res_id):
+        return self._states.get(res_id, {})
 
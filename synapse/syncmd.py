@@ -1,76 +1,250 @@
+import os
 import sys
-import tempfile
+import time
+import errno
+import select
+import signal
+import threading
 
 from subprocess import Popen, PIPE
-from threading import Thread
-
-try:
-    from Queue import Queue, Empty
-except ImportError:
-    from queue import Queue, Empty
 
 
 ON_POSIX = 'posix' in sys.builtin_module_names
-__STDOUTBUF__ = ''
 
+# Characters for which a command string has to be run by a shell
+SHELL_CHARS = frozenset('|&;<>()$`\\"\'*?[]#~=%{}!\n')
 
-def exec_cmd(cmd):
-    ret = {}
-    stdout = tempfile.TemporaryFile(mode='w+t')
-    stderr = tempfile.TemporaryFile(mode='w+t')
-    try:
-        proc = Popen(cmd, shell=True, universal_newlines=True,
-                     stdout=stdout, stderr=stderr)
-        ret_code = proc.wait()
+# Default maximum number of bytes kept from each of stdout and stderr
+MAX_OUTPUT = 1024 * 1024
 
-        stdout.flush()
-        stderr.flush()
+# Seconds to keep reading once the command exited, in case it left
+# children holding its output open (e.g. daemons started by services).
+# What they write afterwards is read and dropped in the background.
+EXIT_GRACE = .5
 
-        out = ''
-        stdout.seek(0)
-        for line in stdout:
-            out += line.rstrip()
+CHUNK_SIZE = 64 * 1024
 
-        err = ''
-        stderr.seek(0)
-        for line in stderr:
-            err += line.rstrip()
 
-        ret['cmd'] = cmd
-        ret['stdout'] = out
-        ret['stderr'] = err
-        ret['returncode'] = ret_code
-        ret['pid'] = proc.pid
+class OutputBuffer(object):
+    """Keeps up to limit bytes of a stream, the rest is counted and
+    dropped."""
 
-    finally:
-        stdout.close()
-        stderr.close()
+    def __init__(self, limit=MAX_OUTPUT):
+        self.limit = limit
+        self.chunks = []
+        self.size = 0
+        self.truncated = False
+
+    def feed(self, data):
+        room = self.limit - self.size if self.limit else len(data)
+        if room < len(data):
+            self.truncated = True
+            data = data[:max(room, 0)]
+        if data:
+            self.chunks.append(data)
+            self.size += len(data)
+
+    def getvalue(self):
+        value = ''.join(self.chunks)
+        return value.replace('\r\n', '\n').replace('\r', '\n')
+
+
+def which(name):
+    """Returns the path of the executable file run for name, or None."""
+    if os.sep in name:
+        paths = [name]
+    else:
+        dirs = os.environ.get('PATH', os.defpath).split(os.pathsep)
+        paths = [os.path.join(directory, name) for directory in dirs]
+    for path in paths:
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
+# Starts commands in a new session without running Python code between fork
+# and exec, which isn't safe in a process with many threads.
+SETSID = which('setsid') if ON_POSIX else None
+
+
+def get_argv(cmd):
+    """Returns the arguments to execute cmd without a shell, or None if it
+    needs one."""
+    if isinstance(cmd, (list, tuple)):
+        return list(cmd)
+    if not ON_POSIX or SHELL_CHARS.intersection(cmd):
+        return None
+    argv = cmd.split()
+    # Builtins such as cd, ulimit or source only exist in the shell
+    if not argv or which(argv[0]) is None:
+        return None
+    return argv
+
+
+def exec_cmd(cmd, timeout=None, max_output=MAX_OUTPUT):
+    """Runs cmd and returns its stdout, stderr and returncode.
+
+    cmd is executed directly if it's a list of arguments or a string
+    without any shell syntax starting with an executable file, through the
+    shell otherwise. If it's still
+    running after timeout seconds, its whole process group is killed. Only
+    the first max_output bytes of stdout and stderr are kept.
+    """
+    ret = {
+        'cmd': cmd,
+        'stdout': '',
+        'stderr': '',
+        'returncode': None,
+        'pid': None,
+        'timed_out': False,
+        'truncated': False
+    }
+
+    argv = get_argv(cmd)
+    if argv is not None and ON_POSIX and which(argv[0]) is None:
+        # Like a shell would do, setsid would report it otherwise
+        ret['stderr'] = '%s: command not found' % argv[0]
+        ret['returncode'] = 127
+        return ret
+
+    args, preexec_fn = argv or cmd, None
+    if ON_POSIX:
+        # The command runs in its own session, so that its whole process
+        # group can be killed.
+        if argv is None:
+            args = ['/bin/sh', '-c', cmd]
+        if SETSID is not None:
+            args = [SETSID] + args
+        else:
+            # Only calls the system call, without taking any lock
+            preexec_fn = os.setsid
+
+    try:
+        proc = Popen(args,
+                     shell=not ON_POSIX and argv is None,
+                     close_fds=ON_POSIX,
+                     preexec_fn=preexec_fn,
+                     stdout=PIPE,
+                     stderr=PIPE)
+    except OSError as err:
+        # Like a shell would do when the command can't be executed
+        ret['stderr'] = '%s: %s' % ((argv or args)[0], err.strerror)
+        ret['returncode'] = 127 if err.errno == errno.ENOENT else 126
+        return ret
+
+    stdout = OutputBuffer(max_output)
+    stderr = OutputBuffer(max_output)
+    if ON_POSIX and hasattr(select, 'poll'):
+        ret['timed_out'] = _collect(proc, stdout, stderr, timeout)
+    else:
+        out, err = proc.communicate()
+        stdout.feed(out)
+        stderr.feed(err)
+
+    ret['stdout'] = stdout.getvalue()
+    ret['stderr'] = stderr.getvalue()
+    ret['returncode'] = proc.returncode
+    ret['pid'] = proc.pid
+    ret['truncated'] = stdout.truncated or stderr.truncated
 
     return ret
 
 
-def exec_threaded_cmd(cmd):
-    proc = Popen(cmd,
-                 shell=True,
-                 bufsize=64,
-                 close_fds=ON_POSIX,
-                 stdout=PIPE,
-                 stderr=PIPE)
-    bufqueue = Queue()
-    t = Thread(target=_enqueue_output, args=(proc.stdout, bufqueue))
-    t.daemon = True
-    t.start()
+def _collect(proc, stdout, stderr, timeout=None):
+    """Reads stdout and stderr of proc as they come until the process exits.
+    Returns True if it had to be killed after timeout seconds."""
+    files = {proc.stdout.fileno(): proc.stdout,
+             proc.stderr.fileno(): proc.stderr}
+    buffers = {proc.stdout.fileno(): stdout, proc.stderr.fileno(): stderr}
+    poller = select.poll()
+    for fd in buffers:
+        poller.register(fd, select.POLLIN)
+
+    now = time.time()
+    deadline = now + timeout if timeout else None
+    exited = None
+    timed_out = False
+    try:
+        while buffers:
+            # Wake up regularly to notice the process exit
+            wait = 1.
+            if deadline is not None:
+                wait = min(wait, deadline - now)
+            if exited is not None:
+                wait = min(wait, exited + EXIT_GRACE - now)
+
+            for fd, event in _poll(poller, max(wait, 0)):
+                data = os.read(fd, CHUNK_SIZE)
+                if data:
+                    buffers[fd].feed(data)
+                else:
+                    poller.unregister(fd)
+                    del buffers[fd]
+                    files.pop(fd).close()
+
+            now = time.time()
+            if exited is None and proc.poll() is not None:
+                exited = now
+            if exited is not None and now >= exited + EXIT_GRACE:
+                break
+            if deadline is not None and now >= deadline:
+                _kill(proc)
+                timed_out = True
+                deadline = None
+    finally:
+        if files:
+            # Processes it left behind still hold the pipes, closing them
+            # would fail their next writes (or kill them with SIGPIPE).
+            _drain_in_background(poller, files)
+        proc.wait()
+
+    return timed_out
 
+
+def _poll(poller, timeout=None):
+    try:
+        return poller.poll(None if timeout is None else timeout * 1000)
+    except select.error as err:
+        if err.args[0] != errno.EINTR:
+            raise
+        return []
+
+
+def _drain_in_background(poller, files):
+    """Reads and drops what's written to files until all their writers
+    closed them, then closes them."""
+    def drain():
+        try:
+            while files:
+                for fd, event in _poll(poller):
+                    if not os.read(fd, CHUNK_SIZE):
+                        poller.unregister(fd)
+                        files.pop(fd).close()
+        finally:
+            for f in files.values():
+                f.close()
+
+    thread = threading.Thread(target=drain, name="CMD-DRAIN")
+    thread.daemon = True
+    thread.start()
+
+
+def _kill(proc):
     try:
-        global __STDOUTBUF__
-        line = bufqueue.get(timeout=.1)
-    except Empty:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
         pass
-    else:
-        __STDOUTBUF__ += line
 
 
-def _enqueue_output(out, queue):
-    for line in iter(out.readline, b''):
-        queue.put(line)
-    out.close()
+def exec_threaded_cmd(cmd, callback=None, **kwargs):
+    """Runs cmd in a background thread, which is returned. The result of
+    exec_cmd is passed to callback if provided."""
+    def run():
+        ret = exec_cmd(cmd, **kwargs)
+        if callback is not None:
+            callback(ret)
+
+    thread = threading.Thread(target=run, name="CMD-%s" % cmd)
+    thread.daemon = True
+    thread.start()
+    return thread
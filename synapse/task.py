@@ -1,6 +1,5 @@
-import json
-
 from pika import BasicProperties
+from synapse import codec
 from synapse.config import config
 from synapse.logger import logger
 from synapse import permissions
@@ -49,17 +48,19 @@ class OutgoingMessage(Message):
         if not isinstance(msg, dict):
             raise ValueError("Outgoing message is not a dict.")
 
-        try:
-            _model.update(msg)
-            msg = json.dumps(_model)
-        except AttributeError as err:
-            raise ValueError("Message not well formatted: %s", err)
-
-        return msg
+        # Encoded once, when the message is published (see AmqpTask.get)
+        _model.update(msg)
+        return _model
 
 
 class IncomingMessage(Message):
 
+    def __init__(self, message, content_type=None):
+        self.content_type = content_type
+        super(IncomingMessage, self).__init__(message)
+        self.collection = self.body['collection']
+        self.action = self.body['action']
+
     def validate(self, msg):
         _model = {
             'id': '',
@@ -69,31 +70,34 @@ class IncomingMessage(Message):
             'monitor': False
         }
 
-        try:
-            msg = json.loads(msg)
-            _model.update(msg)
-        except AttributeError as err:
-            raise ValueError("Message not well formatted: %s", err)
+        msg = codec.decode(msg, self.content_type)
+        if not isinstance(msg, dict):
+            raise ValueError("Message not well formatted: %r" % msg)
+
+        # Defaults are filled in the decoded message itself
+        for key, value in _model.iteritems():
+            msg.setdefault(key, value)
 
-        if 'collection' not in msg or not msg['collection']:
+        if not msg['collection']:
             raise ValueError("Collection missing.")
 
-        if 'action' not in msg or not msg['action']:
+        if not msg['action']:
             raise ValueError("Action missing.")
 
-        if 'attributes' in msg and not isinstance(msg['attributes'], dict):
+        if not isinstance(msg['attributes'], dict):
             raise ValueError("Attributes must be a dict.")
 
-        if 'monitor' in msg and not isinstance(msg['monitor'], bool):
+        if not isinstance(msg['monitor'], bool):
             raise ValueError("Monitor must be a boolean")
 
-        return _model
+        return msg
 
 
 @logger
 class Task(object):
     def __init__(self, message, sender='', check_permissions=True):
-        self.body = message.body
+        # Responses built by the controller itself are plain dicts
+        self.body = getattr(message, 'body', message)
         self.sender = sender
         #TODO: re-enable permission
         #if check_permissions and isinstance(message, IncomingMessage):
@@ -122,6 +126,8 @@ class AmqpTask(Task):
         self.publish_exchange = self._get_publish_exchange(self.headers)
         self.routing_key = self._get_routing_key(self.headers)
         self.redeliver = False
+        self.content_type = self._get_content_type(self.headers)
+        self._encoded = None
 
     def _get_publish_exchange(self, headers):
         publish_exchange = None
@@ -150,6 +156,15 @@ class AmqpTask(Task):
     def _get_correlation_id(self, headers):
         return headers.get('correlation_id')
 
+    def _get_content_type(self, headers):
+        # Replies are encoded like the request when we can
+        content_type = headers.get('content_type')
+        if not codec.is_supported(content_type):
+            content_type = config.rabbitmq['content_type']
+        if not codec.is_supported(content_type):
+            content_type = codec.JSON
+        return content_type
+
     def _get_sender(self, headers):
         return headers.get('user_id') or ''
 
@@ -158,14 +173,15 @@ class AmqpTask(Task):
 
     def get(self):
         basic_properties = BasicProperties(correlation_id=self.correlation_id,
-                                           user_id=self.user_id)
-        body = self.body
-        if isinstance(body, dict):
-            body = json.dumps(self.body)
-        try:
-            return {"exchange": self.publish_exchange,
-                    "routing_key": self.routing_key,
-                    "properties": basic_properties,
-                    "body": body}
-        except ValueError as err:
-            self.logger.error("Invalid message (%s)" % err)
+                                           user_id=self.user_id,
+                                           content_type=self.content_type)
+        # Redelivered tasks are not encoded again
+        if self._encoded is None:
+            body = self.body
+            if not isinstance(body, basestring):
+                body = codec.encode(body, self.content_type)
+            self._encoded = body
+        return {"exchange": self.publish_exchange,
+                "routing_key": self.routing_key,
+                "properties": basic_properties,
+                "body": self._encoded}
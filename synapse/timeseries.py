@@ -0,0 +1,109 @@
+import time
+import threading
+
+
+# (seconds per bucket, number of buckets) of each resolution: 10 minutes of
+# seconds, 24 hours of minutes and 7 days of hours.
+RESOLUTIONS = ((1, 600), (60, 1440), (3600, 168))
+
+
+class Rollup(object):
+    """Min, sum, max and count of the values added in each bucket of step
+    seconds, kept in preallocated arrays used as a ring."""
+
+    def __init__(self, step, size):
+        self.step = step
+        self.size = size
+        self.starts = [None] * size
+        self.counts = [0] * size
+        self.sums = [0.] * size
+        self.mins = [0.] * size
+        self.maxs = [0.] * size
+
+    def add(self, value, timestamp):
+        start = int(timestamp // self.step) * self.step
+        index = (start // self.step) % self.size
+        if self.starts[index] != start:
+            self.starts[index] = start
+            self.counts[index] = 1
+            self.sums[index] = self.mins[index] = self.maxs[index] = value
+            return
+        self.counts[index] += 1
+        self.sums[index] += value
+        if value < self.mins[index]:
+            self.mins[index] = value
+        if value > self.maxs[index]:
+            self.maxs[index] = value
+
+    def aggregate(self, window, now):
+        """Returns the min, avg and max of the values of the buckets which
+        started within the last window seconds, or None."""
+        last = int(now // self.step) * self.step
+        buckets = min(self.size, max(1, int(window // self.step)))
+        count = 0
+        total = 0.
+        low = high = None
+        for start in xrange(last - (buckets - 1) * self.step, last + 1,
+                            self.step):
+            index = (start // self.step) % self.size
+            if self.starts[index] != start:
+                continue
+            count += self.counts[index]
+            total += self.sums[index]
+            if low is None or self.mins[index] < low:
+                low = self.mins[index]
+            if high is None or self.maxs[index] > high:
+                high = self.maxs[index]
+
+        if not count:
+            return None
+        return {'min': low, 'avg': total / count, 'max': high,
+                'count': count}
+
+
+class Series(object):
+    """Bounded history of a metric at several resolutions."""
+
+    def __init__(self, resolutions=RESOLUTIONS):
+        self.rollups = [Rollup(step, size) for step, size in resolutions]
+
+    def add(self, value, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        for rollup in self.rollups:
+            rollup.add(value, timestamp)
+
+    def aggregate(self, window, now=None):
+        """Returns the min, avg and max of the values of the last window
+        seconds, from the finest resolution covering the window."""
+        now = time.time() if now is None else now
+        for rollup in self.rollups:
+            if rollup.step * rollup.size >= window:
+                break
+        return rollup.aggregate(window, now)
+
+
+class TimeSeriesStore(object):
+    """Series indexed by metric name."""
+
+    def __init__(self, resolutions=RESOLUTIONS):
+        self.resolutions = resolutions
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def add(self, name, value, timestamp=None):
+        with self._lock:
+            series = self._series.get(name)
+            if series is None:
+                series = self._series[name] = Series(self.resolutions)
+            series.add(float(value), timestamp)
+
+    def aggregate(self, name, window, now=None):
+        with self._lock:
+            series = self._series.get(name)
+            if series is None:
+                return None
+            return series.aggregate(window, now)
+
+    def names(self):
+        with self._lock:
+            return self._series.keys()
@@ -0,0 +1,84 @@
+import os
+import errno
+
+from Queue import Queue
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class Wakeup(object):
+    """Self-pipe used to wake up a thread polling file descriptors from
+    another thread. The read end can be registered in any poller, it becomes
+    readable once notify is called and until clear is called.
+    """
+
+    def __init__(self):
+        self._read_fd, self._write_fd = os.pipe()
+        for fd in (self._read_fd, self._write_fd):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+        # Avoid filling the pipe when many notifications are sent before the
+        # polling thread wakes up.
+        self._pending = False
+
+    def fileno(self):
+        return self._read_fd
+
+    def notify(self):
+        if self._pending or self._write_fd is None:
+            return
+        self._pending = True
+        try:
+            os.write(self._write_fd, 'x')
+        except OSError as err:
+            # The pipe is full, the poller will wake up anyway.
+            if err.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def clear(self):
+        """Must be called before the polling thread processes the pending
+        work, so that work added meanwhile triggers a new notification.
+        """
+        try:
+            while os.read(self._read_fd, 4096):
+                pass
+        except OSError as err:
+            if err.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+        # Reset once the pipe is drained: a notification sent while draining
+        # would otherwise be lost and the flag would stay set for good. Work
+        # added meanwhile is processed by the caller anyway.
+        self._pending = False
+
+    def close(self):
+        """Closes the pipe. Later notifications are ignored."""
+        if self._write_fd is None:
+            return
+        os.close(self._read_fd)
+        os.close(self._write_fd)
+        self._read_fd = self._write_fd = None
+
+
+def get_wakeup():
+    """Returns a new Wakeup, or None on platforms without pollable pipes."""
+    return Wakeup() if fcntl is not None else None
+
+
+class WakeupQueue(Queue):
+    """A Queue notifying its wakeup pipe each time an item is put in it.
+    The wakeup attribute is None on platforms without pollable pipes.
+    """
+
+    def __init__(self, maxsize=0):
+        Queue.__init__(self, maxsize)
+        self.wakeup = get_wakeup()
+
+    def put(self, item, block=True, timeout=None):
+        Queue.put(self, item, block, timeout)
+        if self.wakeup is not None:
+            self.wakeup.notify()
@@ -0,0 +1,83 @@
+import time
+import socket
+import threading
+import unittest
+
+from pika.adapters.select_connection import IOLoop, SelectPoller, READ
+
+from synapse.amqp import AmqpSynapse
+from synapse.config import config
+from synapse.task import AmqpTask, OutgoingMessage
+from synapse.wakeup import WakeupQueue
+
+
+class FakeChannel(object):
+
+    def __init__(self):
+        self._state = 2
+        self.published = threading.Event()
+
+    def confirm_delivery(self, callback):
+        pass
+
+    def basic_publish(self, **kwargs):
+        self.published.set()
+
+
+class FakeConnection(object):
+
+    def __init__(self, ioloop):
+        self.ioloop = ioloop
+        self.timeouts = []
+
+    def add_timeout(self, deadline, callback):
+        self.timeouts.append(deadline)
+
+
+@unittest.skipIf(hasattr(IOLoop, 'add_handler'), "pika 0.9 is not installed")
+class TestPublisher(unittest.TestCase):
+
+    def setUp(self):
+        # The poller only wakes up on its own every 5 seconds
+        self.timeout = SelectPoller.TIMEOUT
+        SelectPoller.TIMEOUT = 5
+        self.sockets = socket.socketpair()
+
+        self.ioloop = IOLoop(lambda: None)
+        self.ioloop.start_poller(lambda *args, **kwargs: None, READ,
+                                 self.sockets[0].fileno())
+
+        self.pq = WakeupQueue()
+        self.amqp = AmqpSynapse(config.rabbitmq, pq=self.pq, tq=None)
+        self.amqp._connection = FakeConnection(self.ioloop)
+        self.amqp._publish_channel = FakeChannel()
+
+    def tearDown(self):
+        SelectPoller.TIMEOUT = self.timeout
+        for sock in self.sockets:
+            sock.close()
+        self.pq.wakeup.close()
+
+    def test_response_is_published_on_put(self):
+        self.amqp.start_publishing()
+        self.assertFalse(self.amqp._polling)
+        self.assertEqual([], self.amqp._connection.timeouts)
+
+        thread = threading.Thread(target=self.ioloop.poller.start)
+        thread.daemon = True
+        thread.start()
+        try:
+            time.sleep(.1)
+            response = OutgoingMessage(resource_id='test', collection='test')
+            start = time.time()
+            self.pq.put(AmqpTask(response, headers={'reply_to': 'test'}))
+            self.assertTrue(self.amqp._publish_channel.published.wait(2))
+            self.assertTrue(time.time() - start < 1)
+        finally:
+            self.ioloop.stop()
+            self.pq.wakeup.notify()
+            thread.join(1)
+
+
+if __name__ == '__main__':
+    unittest.main()
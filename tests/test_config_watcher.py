@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from synapse.config_watcher import ConfigWatcher
+
+
+class TestConfigWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.watcher = ConfigWatcher(self.folder)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _write(self, name, content):
+        path = os.path.join(self.folder, name)
+        with open(path, 'w') as fd:
+            fd.write(content)
+        return path
+
+    def test_sections_are_merged(self):
+        self._write('a.conf', '[hosts]\ncpu = 30,gt,90\n')
+        self._write('b.conf', '[hosts]\nmemory = 30,gt,80\n[files]\n')
+        self._write('c.txt', '[ignored]\n')
+
+        self.assertTrue(self.watcher.load())
+        self.assertEqual({'hosts': {'cpu': '30,gt,90', 'memory': '30,gt,80'},
+                          'files': {}}, self.watcher.sections)
+
+    def test_unchanged_files_are_not_parsed(self):
+        self._write('a.conf', '[hosts]\ncpu = 30,gt,90\n')
+        self.assertTrue(self.watcher.load())
+
+        self.watcher._parse = None
+        self.assertFalse(self.watcher.load())
+
+    def test_changes_are_detected(self):
+        path = self._write('a.conf', '[hosts]\ncpu = 30,gt,90\n')
+        self.watcher.load()
+
+        self._write('a.conf', '[hosts]\ncpu = 60,gt,90\n')
+        os.utime(path, (1, 1))
+        self.assertTrue(self.watcher.load())
+        self.assertEqual('60,gt,90', self.watcher.sections['hosts']['cpu'])
+
+        os.remove(path)
+        self.assertTrue(self.watcher.load())
+        self.assertEqual({}, self.watcher.sections)
+
+
+if __name__ == '__main__':
+    unittest.main()
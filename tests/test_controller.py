@@ -0,0 +1,122 @@
+import time
+import threading
+import unittest
+
+from Queue import Queue
+
+from synapse.controller import Controller
+from synapse.synapse_exceptions import ResourceException
+
+
+class FakeTask(object):
+
+    def __init__(self, collection, res_id, action=None):
+        self.body = {'collection': collection, 'id': res_id}
+        self.headers = {}
+        self.action = action
+
+
+class FakeResource(object):
+
+    def __init__(self, exclusive=False):
+        self.__exclusive__ = exclusive
+
+
+class FakeLocator(object):
+
+    resources = {'files': FakeResource(), 'users': FakeResource(True)}
+
+    def get_instance(self, collection):
+        try:
+            return self.resources[collection]
+        except KeyError:
+            raise ResourceException("Unknown collection")
+
+
+class WorkersController(Controller):
+
+    def __init__(self, workers):
+        self.wq = Queue()
+        self.workers = []
+        self.workers_count = workers
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self.locator = FakeLocator()
+        self.runs = []
+        self.done = Queue()
+
+    def process_task(self, task):
+        try:
+            self.runs.append(('start', task.body['id']))
+            if task.action is not None:
+                task.action()
+            self.runs.append(('end', task.body['id']))
+        finally:
+            self.done.put(task)
+
+
+class TestWorkers(unittest.TestCase):
+
+    def setUp(self):
+        self.controller = WorkersController(4)
+        self.controller._start_workers()
+
+    def tearDown(self):
+        self.controller._stop_workers()
+
+    def _wait(self, count):
+        for index in range(count):
+            self.controller.done.get(timeout=5)
+        # The key is released right after process_task returns
+        time.sleep(.05)
+
+    def test_same_resource_in_order(self):
+        for index in range(3):
+            self.controller._dispatch(
+                FakeTask('files', '/etc/hosts',
+                         action=lambda: time.sleep(.05)))
+        self._wait(3)
+        self.assertEqual([('start', '/etc/hosts'), ('end', '/etc/hosts')] * 3,
+                         self.controller.runs)
+        self.assertEqual({}, self.controller._pending)
+
+    def test_different_resources_run_concurrently(self):
+        started = threading.Event()
+        overlapped = []
+        self.controller._dispatch(
+            FakeTask('files', 'a',
+                     action=lambda: overlapped.append(started.wait(2))))
+        self.controller._dispatch(
+            FakeTask('files', 'b', action=started.set))
+        self._wait(2)
+        self.assertEqual([True], overlapped)
+        self.assertEqual({}, self.controller._pending)
+
+    def test_exclusive_resource_is_serialized(self):
+        started = threading.Event()
+        overlapped = []
+        self.controller._dispatch(
+            FakeTask('users', 'alice',
+                     action=lambda: overlapped.append(started.wait(.2))))
+        self.controller._dispatch(
+            FakeTask('users', 'bob', action=started.set))
+        self._wait(2)
+        self.assertEqual([False], overlapped)
+        self.assertEqual({}, self.controller._pending)
+
+    def test_failed_task_releases_its_resource(self):
+        def fail():
+            raise RuntimeError("failed")
+
+        for index in range(self.controller.workers_count + 1):
+            self.controller._dispatch(FakeTask('files', 'a', action=fail))
+        self.controller._dispatch(FakeTask('files', 'a'))
+        self._wait(self.controller.workers_count + 2)
+        self.assertEqual(('end', 'a'), self.controller.runs[-1])
+        self.assertEqual({}, self.controller._pending)
+        self.assertTrue(all(worker.isAlive()
+                            for worker in self.controller.workers))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import imp
+import shutil
+import tempfile
+import unittest
+
+from synapse.config import config
+
+digests = imp.load_source('digests', os.path.join(
+    os.path.dirname(__file__), '..', 'synapse', 'resources', 'files-plugin',
+    'digests.py'))
+
+
+class Stat(object):
+
+    def __init__(self, ino=1, size=10, mtime_ns=1000):
+        self.st_ino = ino
+        self.st_size = size
+        self.st_mtime_ns = mtime_ns
+
+
+class TestDigestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self._saved = config.controller['persistence_path']
+        config.controller['persistence_path'] = self.folder
+        self.cache = digests.DigestCache()
+        self.computed = []
+
+    def tearDown(self):
+        config.controller['persistence_path'] = self._saved
+        shutil.rmtree(self.folder)
+
+    def _compute(self, path, algorithm):
+        self.computed.append(path)
+        return '%s-%d' % (algorithm, len(self.computed))
+
+    def _get(self, path, si, algorithm='md5'):
+        return self.cache.get(path, si, algorithm, self._compute)
+
+    def test_hit(self):
+        self.assertEqual('md5-1', self._get('/a', Stat()))
+        self.assertEqual('md5-1', self._get('/a', Stat()))
+        self.assertEqual(['/a'], self.computed)
+
+    def test_invalidation(self):
+        self._get('/a', Stat())
+        for si in (Stat(ino=2), Stat(size=11), Stat(mtime_ns=1001)):
+            self._get('/a', si)
+        self._get('/a', Stat(mtime_ns=1001), 'sha256')
+        self.assertEqual(5, len(self.computed))
+
+    def test_eviction_on_save(self):
+        self._get('/a', Stat())
+        self._get('/b', Stat())
+        self.cache.save(paths=set(['/a']))
+
+        cache = digests.DigestCache()
+        self.assertEqual('md5-1', cache.get('/a', Stat(), 'md5',
+                                            self._compute))
+        self.assertEqual('md5-3', cache.get('/b', Stat(), 'md5',
+                                            self._compute))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import time
+import threading
+import unittest
+
+from synapse import facts
+
+
+class TestFacts(unittest.TestCase):
+
+    def setUp(self):
+        self.reads = []
+        self.release = threading.Event()
+
+        def _read_facts():
+            self.reads.append(time.time())
+            self.release.wait(5)
+            return {'hostname': 'host-%d' % len(self.reads)}
+
+        self._saved = facts.read_facts
+        facts.read_facts = _read_facts
+        self.facts = facts.Facts()
+
+    def tearDown(self):
+        self.release.set()
+        facts.read_facts = self._saved
+
+    def test_background_refresh_doesnt_block(self):
+        start = time.time()
+        self.facts.refresh_in_background()
+        self.assertTrue(time.time() - start < .5)
+
+        # A single refresh runs at a time
+        time.sleep(.05)
+        self.facts.refresh_in_background()
+        self.assertEqual(1, len(self.reads))
+
+        self.release.set()
+        time.sleep(.1)
+        self.assertEqual('host-1', self.facts.get()['hostname'])
+
+        self.facts.refresh_in_background()
+        time.sleep(.1)
+        self.assertEqual('host-2', self.facts.get()['hostname'])
+
+    def test_failed_background_refresh_keeps_facts(self):
+        self.release.set()
+        self.facts.refresh()
+
+        def _fail():
+            raise IOError("resolver failure")
+
+        facts.read_facts = _fail
+        self.facts.refresh_in_background()
+        time.sleep(.1)
+        self.assertEqual('host-1', self.facts.get()['hostname'])
+        # The failure doesn't prevent later refreshes
+        self.assertTrue(self.facts._refreshing.acquire(False))
+
+
+if __name__ == '__main__':
+    unittest.main()
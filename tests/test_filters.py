@@ -0,0 +1,45 @@
+import unittest
+
+from synapse import filters
+from synapse.facts import get_facts
+
+
+class TestFilters(unittest.TestCase):
+
+    def setUp(self):
+        self.facts = get_facts()
+        self.saved = self.facts._facts
+        self.facts._facts = {
+            'hostname': 'web01.example.com',
+            'ips': {'lo': '127.0.0.1', 'eth0': '10.0.0.12'},
+            'macs': {'eth0': '52:54:00:12:34:56', 'eth1': '52:54:00:12:34:5a'},
+            'platform': 'Linux',
+        }
+
+    def tearDown(self):
+        self.facts._facts = self.saved
+
+    def _check(self, name, value):
+        return filters.get_filter(name).check(value)
+
+    def test_wildcards(self):
+        self.assertTrue(self._check('hostnames', ['db*', 'web*.example.*']))
+        self.assertFalse(self._check('hostnames', ['db*']))
+        self.assertTrue(self._check('ipaddresses', ['10.0.*']))
+        self.assertFalse(self._check('ipaddresses', ['10.1.*']))
+
+    def test_mac_addresses_ignore_case(self):
+        self.assertTrue(self._check('macaddresses', ['52:54:00:12:34:56']))
+        self.assertTrue(self._check('macaddresses', ['52:54:00:12:34:5A']))
+        self.assertFalse(self._check('macaddresses', ['52:54:00:12:34:57']))
+
+    def test_unknown_filter(self):
+        self.assertEqual(None, filters.get_filter('colors'))
+
+    def test_patterns_are_memoized(self):
+        pattern = filters.get_pattern('a.*')
+        self.assertTrue(pattern is filters.get_pattern('a.*'))
+
+
+if __name__ == '__main__':
+    unittest.main()
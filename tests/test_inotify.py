@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from synapse import inotify
+
+
+@unittest.skipUnless(inotify.is_available(), "inotify is not available")
+class TestFileWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.watcher = inotify.FileWatcher()
+        self.a = os.path.join(self.tmpdir, 'a')
+        self.b = os.path.join(self.tmpdir, 'sub', 'b')
+        for path in (self.a, self.b):
+            self.watcher.watch(self, path)
+        self.wd = self.watcher._dirs[self.tmpdir]
+
+    def tearDown(self):
+        self.watcher.inotify.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_event_matches_entry(self):
+        changed = self.watcher._get_changed_paths(
+            [(self.wd, inotify.IN_MODIFY, 'a'),
+             (self.wd, inotify.IN_MODIFY, 'other')])
+        self.assertEqual(set([self.a]), changed)
+
+        changed = self.watcher._get_changed_paths(
+            [(self.wd, inotify.IN_CREATE, 'sub')])
+        self.assertEqual(set([self.b]), changed)
+
+    def test_directory_removal_matches_all_paths(self):
+        changed = self.watcher._get_changed_paths(
+            [(self.wd, inotify.IN_DELETE_SELF, '')])
+        self.assertEqual(set([self.a, self.b]), changed)
+        self.assertFalse(self.tmpdir in self.watcher._dirs)
+
+    def test_unwatch_releases_directory(self):
+        self.watcher.unwatch(self, self.a)
+        self.assertTrue(self.tmpdir in self.watcher._dirs)
+        self.watcher.unwatch(self, self.b)
+        self.assertFalse(self.tmpdir in self.watcher._dirs)
+        self.assertEqual({}, self.watcher._entries)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import os
+import imp
+import sys
+import time
+import unittest
+
+from Queue import Queue
+
+PLUGIN_PATH = os.path.join(os.path.dirname(__file__), '..', 'synapse',
+                           'resources', 'nagios-plugin')
+sys.path.insert(0, PLUGIN_PATH)
+checks = imp.load_source('checks', os.path.join(PLUGIN_PATH, 'checks.py'))
+nagios = imp.load_source('nagios', os.path.join(PLUGIN_PATH, 'nagios.py'))
+
+
+class TestCheckRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.results = Queue()
+        self.runner = checks.CheckRunner(
+            lambda name, result: self.results.put((name, result)),
+            max_checks=2, timeout=5)
+
+    def tearDown(self):
+        self.runner.shutdown()
+
+    def test_overlapping_run_is_refused(self):
+        self.assertTrue(self.runner.submit('slow', 'sleep .2'))
+        self.assertFalse(self.runner.submit('slow', 'sleep .2'))
+        self.assertTrue(self.runner.submit('other', 'true'))
+
+        names = [self.results.get(timeout=5)[0] for index in range(2)]
+        self.assertEqual(['other', 'slow'], names)
+        time.sleep(.05)
+        self.assertTrue(self.runner.submit('slow', 'true'))
+        self.assertEqual('slow', self.results.get(timeout=5)[0])
+
+    def test_live_run_doesnt_overlap_scheduled_run(self):
+        self.assertTrue(self.runner.submit('slow', 'sleep .2'))
+        self.assertEqual(None, self.runner.run('slow', 'true'))
+        result = self.runner.run('slow', 'echo live', overlap=True)
+        self.assertEqual('live\n', result['stdout'])
+        self.results.get(timeout=5)
+
+    def test_timeout(self):
+        start = time.time()
+        self.assertTrue(self.runner.submit('hung', 'sleep 10', timeout=.2))
+        name, result = self.results.get(timeout=5)
+        self.assertTrue(result['timed_out'])
+        self.assertTrue(time.time() - start < 5)
+        # The check can be scheduled again once killed
+        time.sleep(.05)
+        self.assertTrue(self.runner.submit('hung', 'true'))
+
+
+class TestOffset(unittest.TestCase):
+
+    def test_offset_is_stable_and_within_interval(self):
+        for name in ('check_load', 'check_disk', 'check_http'):
+            offset = checks.get_offset(name, 60)
+            self.assertEqual(offset, checks.get_offset(name, 60))
+            self.assertTrue(0 <= offset < 60)
+        self.assertEqual(0, checks.get_offset('check_load', 0))
+
+    def test_offsets_are_spread(self):
+        offsets = [checks.get_offset('check_%d' % index, 60)
+                   for index in range(200)]
+        # Every 6 seconds slot of the interval gets some checks
+        slots = set(int(offset // 6) for offset in offsets)
+        self.assertEqual(set(range(10)), slots)
+        self.assertTrue(len(set(offsets)) > 190)
+
+
+class FakeRunner(object):
+
+    def __init__(self):
+        self.runs = []
+        self.running = set()
+
+    def run(self, name, command, timeout=None, overlap=False):
+        if name in self.running and not overlap:
+            return None
+        self.runs.append(name)
+        return {'stdout': 'OK - live', 'returncode': 0}
+
+
+class TestRead(unittest.TestCase):
+
+    def setUp(self):
+        self.controller = nagios.NagiosPluginsController.__new__(
+            nagios.NagiosPluginsController)
+        self.controller.plugins = {'check_load': {'command': 'check_load'}}
+        self.controller.results = checks.ResultStore()
+        self.controller.checks = FakeRunner()
+
+    def _schedule_result(self, age=0):
+        self.controller.results.set('check_load', {'stdout': 'OK - scheduled',
+                                                   'returncode': 0})
+        self.controller.results._results['check_load']['timestamp'] -= age
+
+    def _read(self, **attributes):
+        attributes['check_load'] = None
+        return self.controller.read(attributes=attributes)['check_load']
+
+    def test_fresh_result_is_cached(self):
+        self._schedule_result(age=5)
+        result = self._read(max_age=60)
+        self.assertEqual('OK - scheduled', result['output'])
+        self.assertFalse(result['stale'])
+        self.assertEqual([], self.controller.checks.runs)
+
+    def test_expired_result_is_run_again(self):
+        self._schedule_result(age=120)
+        result = self._read(max_age=60)
+        self.assertEqual('OK - live', result['output'])
+        self.assertFalse(result['stale'])
+        self.assertEqual(['check_load'], self.controller.checks.runs)
+        self.assertEqual('OK - live',
+                         self.controller.results.get('check_load')['output'])
+
+    def test_expired_result_of_running_check_is_stale(self):
+        self._schedule_result(age=120)
+        self.controller.checks.running.add('check_load')
+        result = self._read(max_age=60)
+        self.assertEqual('OK - scheduled', result['output'])
+        self.assertTrue(result['stale'])
+
+    def test_force(self):
+        self._schedule_result()
+        self.controller.checks.running.add('check_load')
+        result = self._read(force='true')
+        self.assertEqual('OK - live', result['output'])
+        self.assertEqual(['check_load'], self.controller.checks.runs)
+
+    def test_missing_result_is_run(self):
+        result = self._read()
+        self.assertEqual('OK - live', result['output'])
+        self.assertFalse(result['stale'])
+
+    def test_invalid_max_age(self):
+        self.assertRaises(nagios.ResourceException, self._read, max_age='x')
+
+
+if __name__ == '__main__':
+    unittest.main()
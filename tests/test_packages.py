@@ -0,0 +1,243 @@
+import os
+import imp
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+from synapse.config import config
+from synapse.synapse_exceptions import ResourceException
+
+PLUGIN_PATH = os.path.join(os.path.dirname(__file__), '..', 'synapse',
+                           'resources', 'packages-plugin')
+sys.path.insert(0, PLUGIN_PATH)
+transactions = imp.load_source('transactions',
+                               os.path.join(PLUGIN_PATH, 'transactions.py'))
+packages = imp.load_source('packages_plugin',
+                           os.path.join(PLUGIN_PATH, 'packages.py'))
+apt = imp.load_source('apt_plugin', os.path.join(PLUGIN_PATH, 'apt.py'))
+
+
+class TestTransactionCoalescer(unittest.TestCase):
+
+    def setUp(self):
+        self.runs = []
+        self.errors = {}
+        self.release = threading.Event()
+        self.release.set()
+        self.coalescer = transactions.TransactionCoalescer(self._run,
+                                                           window=.1)
+
+    def _run(self, action, names):
+        self.release.wait()
+        self.runs.append((action, names))
+        if action in self.errors:
+            raise self.errors[action]
+
+    def _submit(self, action, names, results):
+        def submit():
+            results.append(self.coalescer.submit(action, names))
+        thread = threading.Thread(target=submit)
+        thread.start()
+        return thread
+
+    def test_lone_submission_runs_right_away(self):
+        start = time.time()
+        names, error = self.coalescer.submit('install', ['vim'])
+        self.assertTrue(time.time() - start < .1)
+        self.assertEqual(set(['vim']), names)
+        self.assertEqual(None, error)
+        self.assertEqual([('install', ['vim'])], self.runs)
+
+    def test_submissions_during_a_transaction_are_batched(self):
+        self.release.clear()
+        results = []
+        threads = [self._submit('install', ['vim'], results)]
+        time.sleep(.05)
+        threads.append(self._submit('install', ['git'], results))
+        threads.append(self._submit('install', ['curl', 'git'], results))
+        time.sleep(.05)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([('install', ['vim']),
+                          ('install', ['curl', 'git'])], self.runs)
+        self.assertEqual(2, len([names for names, error in results
+                                 if names == set(['curl', 'git'])]))
+
+    def test_actions_are_separated(self):
+        self.release.clear()
+        results = []
+        threads = [self._submit('install', ['vim'], results)]
+        time.sleep(.05)
+        threads.append(self._submit('install', ['git'], results))
+        threads.append(self._submit('remove', ['nano'], results))
+        time.sleep(.05)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(3, len(self.runs))
+        self.assertTrue(('install', ['git']) in self.runs)
+        self.assertTrue(('remove', ['nano']) in self.runs)
+
+    def test_error_is_returned_to_every_submitter(self):
+        error = ResourceException("failed")
+        self.errors['install'] = error
+        self.release.clear()
+        results = []
+        threads = [self._submit('remove', ['nano'], results)]
+        time.sleep(.05)
+        threads.append(self._submit('install', ['vim'], results))
+        threads.append(self._submit('install', ['git'], results))
+        time.sleep(.05)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+
+        errors = [err for names, err in results if 'nano' not in names]
+        self.assertEqual([error, error], errors)
+
+    def test_run_alone_waits_for_the_running_transaction(self):
+        self.release.clear()
+        thread = self._submit('install', ['vim'], [])
+        time.sleep(.05)
+        done = []
+        alone = threading.Thread(
+            target=lambda: done.append(self.coalescer.run_alone('remove',
+                                                                ['git'])))
+        alone.start()
+        time.sleep(.05)
+        self.assertEqual([], done)
+        self.release.set()
+        thread.join()
+        alone.join()
+        self.assertEqual([('install', ['vim']), ('remove', ['git'])],
+                         self.runs)
+
+
+class FakeModule(object):
+
+    def __init__(self, installed=(), broken=()):
+        self.installed = set(installed)
+        self.broken = set(broken)
+        self.runs = []
+
+    def is_installed(self, name):
+        return name in self.installed
+
+    def install(self, names):
+        self.runs.append(('install', list(names)))
+        if self.broken.intersection(names):
+            raise ResourceException("Can't install %s" % ' '.join(names))
+        self.installed.update(names)
+
+
+class TestApply(unittest.TestCase):
+
+    def setUp(self):
+        self.module = FakeModule(broken=['broken'])
+        self.controller = packages.PackagesController.__new__(
+            packages.PackagesController)
+        self.controller.module = self.module
+        self.controller.transactions = transactions.TransactionCoalescer(
+            self.controller._run_transaction)
+
+    def test_own_error_is_raised(self):
+        self.assertRaises(ResourceException, self.controller._apply,
+                          'install', ['broken'])
+        self.assertEqual([('install', ['broken'])], self.module.runs)
+
+    def test_other_request_error_is_retried_alone(self):
+        self.controller.transactions.submit = \
+            lambda action, names: (set(['vim', 'broken']),
+                                   ResourceException("Can't install"))
+        self.controller._apply('install', ['vim'])
+        self.assertEqual([('install', ['vim'])], self.module.runs)
+        self.assertTrue(self.module.is_installed('vim'))
+
+    def test_installed_despite_the_error(self):
+        self.module.installed.add('vim')
+        self.controller.transactions.submit = \
+            lambda action, names: (set(['vim', 'broken']),
+                                   ResourceException("Can't install"))
+        self.controller._apply('install', ['vim'])
+        self.assertEqual([], self.module.runs)
+
+
+class FakeClock(object):
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class TestAptIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.lists = os.path.join(self.tmpdir, 'lists')
+        self.sources = os.path.join(self.tmpdir, 'sources.list.d')
+        os.mkdir(self.lists)
+        os.mkdir(self.sources)
+        for path in (self.lists, self.sources):
+            os.utime(path, (1000, 1000))
+
+        self.commands = []
+
+        def _exec_cmd(cmd):
+            self.commands.append(cmd)
+            return {'returncode': 0, 'stdout': '', 'stderr': ''}
+
+        self.clock = FakeClock(10000)
+        self._saved = (apt.exec_cmd, apt.time, apt.APT_LISTS,
+                       apt.APT_SOURCES, config.packages['index_ttl'])
+        apt.exec_cmd = _exec_cmd
+        apt.time = self.clock
+        apt.APT_LISTS = (self.lists,)
+        apt.APT_SOURCES = (self.sources,)
+        apt._last_refresh[0] = 0
+        config.packages['index_ttl'] = 3600
+
+    def tearDown(self):
+        (apt.exec_cmd, apt.time, apt.APT_LISTS, apt.APT_SOURCES,
+         config.packages['index_ttl']) = self._saved
+        apt._last_refresh[0] = 0
+        shutil.rmtree(self.tmpdir)
+
+    def _updates(self):
+        return self.commands.count('/usr/bin/apt-get -qy update')
+
+    def test_refresh_within_ttl_is_skipped(self):
+        apt._refresh_index()
+        self.assertEqual(1, self._updates())
+        self.clock.now += 3000
+        apt._refresh_index()
+        self.assertEqual(1, self._updates())
+        self.clock.now += 601
+        apt._refresh_index()
+        self.assertEqual(2, self._updates())
+
+    def test_source_change_refreshes(self):
+        apt._refresh_index()
+        self.clock.now += 60
+        source = os.path.join(self.sources, 'extra.list')
+        open(source, 'w').close()
+        os.utime(source, (self.clock.now, self.clock.now))
+        apt._refresh_index()
+        self.assertEqual(2, self._updates())
+
+    def test_ttl_zero_always_refreshes(self):
+        config.packages['index_ttl'] = 0
+        apt._refresh_index()
+        apt._refresh_index()
+        self.assertEqual(2, self._updates())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,7 @@
 import re
 import os
+import shutil
+import tempfile
 import unittest
 
 from synapse import permissions
@@ -222,5 +224,57 @@ class TestPermissionsFile(unittest.TestCase):
         self.assertTrue(action in perms)
 
 
+class TestPermissionSet(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'permissions.conf')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _write(self, lines, mtime):
+        with open(self.path, 'w') as fd:
+            fd.write('\n'.join(lines))
+        os.utime(self.path, (mtime, mtime))
+
+    def test_same_decisions_as_linear_check(self):
+        lines = ["cortex files /etc/httpd/* CRD",
+                 "cor packages * R",
+                 "* executables * -",
+                 "admin * * CRUD",
+                 "* files /tmp/* CRU",
+                 "* * * R"]
+        perm_list = [permissions.process(line) for line in lines]
+        perm_set = permissions.PermissionSet(perm_list)
+
+        for user in ('cortex', 'cor', 'co', 'admin', 'administrator', ''):
+            for collection in ('files', 'packages', 'executables', 'f'):
+                for res_id in ('/etc/httpd/a', '/tmp/b', 'httpd', ''):
+                    self.assertEqual(
+                        permissions.check(perm_list, user, collection,
+                                          res_id),
+                        perm_set.check(user, collection, res_id))
+
+    def test_decisions_cache_is_bounded(self):
+        perm_set = permissions.PermissionSet(
+            [permissions.process("* * * R")], cache_size=2)
+        for res_id in ('a', 'b', 'c'):
+            perm_set.check('cortex', 'files', res_id)
+        self.assertEqual([('cortex', 'files', 'b'), ('cortex', 'files', 'c')],
+                         list(perm_set._cache))
+
+    def test_reloaded_when_modified(self):
+        self._write(["* * * R"], 1000)
+        first = permissions.get(self.path)
+        self.assertTrue(first is permissions.get(self.path))
+
+        self._write(["* * * CRUD"], 2000)
+        second = permissions.get(self.path)
+        self.assertFalse(first is second)
+        self.assertTrue('update' in permissions.check(second, 'cortex',
+                                                      'files', '/etc/hosts'))
+
+
 if __name__ == '__main__':
     unittest.main()
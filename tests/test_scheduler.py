@@ -0,0 +1,96 @@
+import time
+import threading
+import unittest
+
+from synapse.scheduler import SynSched, CATCHUP
+
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = SynSched()
+        self.scheduler.daemon = True
+        self.scheduler.start()
+        self.runs = []
+
+    def tearDown(self):
+        self.scheduler.shutdown()
+        self.scheduler.join()
+
+    def _job(self, name):
+        self.runs.append((name, time.time()))
+
+    def _count(self, name):
+        return len([run for run in self.runs if run[0] == name])
+
+    def test_job_runs_periodically(self):
+        self.scheduler.add_job(self._job, .1, actionargs=('a',))
+        time.sleep(.35)
+        self.assertTrue(3 <= self._count('a') <= 5)
+
+    def test_delay(self):
+        self.scheduler.add_job(self._job, 10, actionargs=('a',), delay=.1)
+        time.sleep(.05)
+        self.assertEqual(0, self._count('a'))
+        time.sleep(.15)
+        self.assertEqual(1, self._count('a'))
+
+    def test_same_job_is_replaced(self):
+        # Delayed, the first one can't run before being replaced
+        first = self.scheduler.add_job(self._job, 10, actionargs=('a',),
+                                       delay=.05)
+        second = self.scheduler.add_job(self._job, 10, actionargs=('a',),
+                                        delay=.05)
+        time.sleep(.15)
+        self.assertEqual(first, second)
+        self.assertEqual(1, self._count('a'))
+
+    def test_update_job_keeps_unchanged_job(self):
+        job_id = self.scheduler.add_job(self._job, 10, actionargs=('a',),
+                                        delay=5)
+        job = self.scheduler.get_job(job_id)
+        self.scheduler.update_job(self._job, 10, actionargs=('a',))
+        self.assertTrue(self.scheduler.get_job(job_id) is job)
+        self.scheduler.update_job(self._job, 20, actionargs=('a',))
+        self.assertEqual(20, self.scheduler.get_job(job_id).interval)
+
+    def test_remove_job(self):
+        job_id = self.scheduler.add_job(self._job, .05, actionargs=('a',))
+        time.sleep(.02)
+        self.assertTrue(self.scheduler.remove_job(job_id))
+        count = self._count('a')
+        time.sleep(.15)
+        self.assertEqual(count, self._count('a'))
+        self.assertFalse(self.scheduler.remove_job(job_id))
+
+    def test_missed_runs(self):
+        block = threading.Event()
+        self.scheduler.add_job(block.wait, 10, actionargs=(.3,))
+        self.scheduler.add_job(self._job, .1, actionargs=('skip',))
+        self.scheduler.add_job(self._job, .1, actionargs=('catchup',),
+                               missed=CATCHUP)
+        time.sleep(.35)
+        self.assertEqual(1, self._count('skip'))
+        self.assertTrue(self._count('catchup') >= 3)
+
+    def test_idle_scheduler_sleeps(self):
+        waits = []
+        wait = self.scheduler._wait
+
+        def _wait(timeout=None):
+            waits.append(timeout)
+            wait(timeout)
+
+        self.scheduler._wait = _wait
+        self.scheduler.add_job(self._job, 10, actionargs=('a',), delay=10)
+        time.sleep(.3)
+        self.assertTrue(len(waits) <= 2)
+
+        # Adding a job wakes the scheduler up
+        self.scheduler.add_job(self._job, 10, actionargs=('b',))
+        time.sleep(.05)
+        self.assertEqual(1, self._count('b'))
+
+
+if __name__ == '__main__':
+    unittest.main()
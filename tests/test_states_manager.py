@@ -0,0 +1,128 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from synapse.config import config
+from synapse.states_manager import StatesManager
+
+
+class TestStatesManager(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self._persistence_path = config.controller['persistence_path']
+        config.controller['persistence_path'] = self.folder
+
+    def tearDown(self):
+        config.controller['persistence_path'] = self._persistence_path
+        shutil.rmtree(self.folder)
+
+    def _journal_size(self, manager):
+        return os.path.getsize(manager.journal_path)
+
+    def test_states_are_reloaded(self):
+        manager = StatesManager('files')
+        manager.save_state('/etc/hosts', {'present': True}, True)
+        manager.save_state('/etc/motd', {'present': False}, True)
+
+        states = StatesManager('files').states
+        self.assertEqual(['/etc/hosts', '/etc/motd'],
+                         [state['resource_id'] for state in states])
+        self.assertEqual({'present': True}, states[0]['status'])
+
+    def test_removed_states_are_not_reloaded(self):
+        manager = StatesManager('files')
+        manager.save_state('/etc/hosts', {'present': True}, True)
+        manager.save_state('/etc/hosts', {}, False)
+
+        self.assertEqual([], StatesManager('files').states)
+
+    def test_unchanged_states_are_not_written(self):
+        manager = StatesManager('files')
+        manager.save_state('/etc/hosts', {'present': True}, True)
+        size = self._journal_size(manager)
+
+        manager.persist('/etc/hosts')
+        manager.persist()
+
+        self.assertEqual(size, self._journal_size(manager))
+
+    def test_only_changed_state_is_written(self):
+        manager = StatesManager('files')
+        manager.save_state('/etc/hosts', {'present': True}, True)
+        manager.save_state('/etc/motd', {'present': True}, True)
+        size = self._journal_size(manager)
+
+        manager.states[0]['compliant'] = False
+        manager.persist()
+
+        with open(manager.journal_path, 'rb') as fd:
+            fd.seek(size)
+            res_id, state = pickle.load(fd)
+            self.assertRaises(EOFError, pickle.load, fd)
+        self.assertEqual('/etc/hosts', res_id)
+        self.assertFalse(state['compliant'])
+
+    def test_sweep_writes_changes_once(self):
+        manager = StatesManager('files')
+        manager.save_state('/etc/hosts', {'present': True}, True)
+        manager.save_state('/etc/motd', {'present': True}, True)
+        size = self._journal_size(manager)
+        records = manager._journal_records
+
+        with manager.sweep():
+            for state in manager.states:
+                state['compliant'] = False
+                manager.persist(state['resource_id'])
+                self.assertEqual(size, self._journal_size(manager))
+
+        self.assertEqual(records + 2, manager._journal_records)
+        states = StatesManager('files').states
+        self.assertFalse(states[0]['compliant'] or states[1]['compliant'])
+
+    def test_unchanged_sweep_does_not_write(self):
+        manager = StatesManager('files')
+        manager.save_state('/etc/hosts', {'present': True}, True)
+        size = self._journal_size(manager)
+
+        with manager.sweep():
+            for state in manager.states:
+                state['compliant'] = True
+                manager.persist(state['resource_id'])
+
+        self.assertEqual(size, self._journal_size(manager))
+
+    def test_journal_is_compacted(self):
+        manager = StatesManager('files')
+        manager.COMPACT_THRESHOLD = 5
+        for index in range(10):
+            manager.save_state('/etc/hosts', {'index': index}, True)
+
+        self.assertTrue(manager._journal_records <= 6)
+        state = StatesManager('files').states[0]
+        self.assertEqual({'index': 9}, state['status'])
+
+    def test_truncated_journal_is_ignored(self):
+        manager = StatesManager('files')
+        manager.save_state('/etc/hosts', {'present': True}, True)
+        manager.save_state('/etc/motd', {'present': True}, True)
+        with open(manager.journal_path, 'rb+') as fd:
+            fd.truncate(self._journal_size(manager) - 5)
+
+        states = StatesManager('files').states
+        self.assertEqual(['/etc/hosts'],
+                         [state['resource_id'] for state in states])
+
+    def test_load_legacy_snapshot(self):
+        states = [{'resource_id': 'htop', 'status': {'installed': True},
+                   'compliant': True, 'back_to_compliance': False}]
+        with open(os.path.join(self.folder, 'packages.pkl'), 'wb') as fd:
+            pickle.dump(states, fd)
+
+        self.assertEqual(states, StatesManager('packages').states)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from synapse.syncmd import exec_cmd, get_argv
+
+
+class TestSyncmd(unittest.TestCase):
+
+    def test_output_keeps_newlines(self):
+        ret = exec_cmd("printf 'a\\nb\\n'")
+        self.assertEqual(0, ret['returncode'])
+        self.assertEqual('a\nb\n', ret['stdout'])
+
+    def test_stdout_and_stderr(self):
+        ret = exec_cmd("echo out; echo err >&2; exit 3")
+        self.assertEqual(3, ret['returncode'])
+        self.assertEqual('out\n', ret['stdout'])
+        self.assertEqual('err\n', ret['stderr'])
+
+    def test_argv(self):
+        self.assertEqual(['ls', '-l', '/tmp'], get_argv('ls -l  /tmp'))
+        self.assertEqual(None, get_argv('ls /tmp | wc -l'))
+        self.assertEqual(['echo', 'a b'], get_argv(['echo', 'a b']))
+        self.assertEqual('a b\n', exec_cmd(['echo', 'a b'])['stdout'])
+
+    def test_shell_builtins(self):
+        self.assertEqual(None, get_argv('cd /tmp'))
+        ret = exec_cmd('ulimit -n')
+        self.assertEqual(0, ret['returncode'])
+        self.assertTrue(ret['stdout'].strip().isdigit())
+        self.assertEqual(0, exec_cmd('umask')['returncode'])
+
+    @unittest.skipUnless(os.path.exists('/proc/self/stat'), "no procfs")
+    def test_command_runs_in_its_own_session(self):
+        ret = exec_cmd('cat /proc/self/stat')
+        fields = ret['stdout'].split(')')[-1].split()
+        # Process group and session ids follow the state and parent pid
+        self.assertEqual([str(ret['pid'])] * 2, fields[2:4])
+
+    def test_missing_command(self):
+        ret = exec_cmd('/nonexistent/command')
+        self.assertEqual(127, ret['returncode'])
+        ret = exec_cmd(['/nonexistent/command'])
+        self.assertEqual(127, ret['returncode'])
+
+    def test_timeout_kills_process_group(self):
+        start = time.time()
+        ret = exec_cmd("sleep 10 | sleep 10", timeout=.2)
+        self.assertTrue(ret['timed_out'])
+        self.assertTrue(time.time() - start < 5)
+
+    def test_output_is_capped(self):
+        ret = exec_cmd("head -c 100000 /dev/zero", max_output=1000)
+        self.assertEqual(1000, len(ret['stdout']))
+        self.assertTrue(ret['truncated'])
+        self.assertEqual(0, ret['returncode'])
+
+    def test_daemon_keeps_its_output(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        marker = os.path.join(tmpdir, 'done')
+        # The background process writes once exec_cmd returned
+        ret = exec_cmd("(sleep 2; echo late && touch %s) & echo started" %
+                       marker)
+        self.assertEqual('started\n', ret['stdout'])
+        self.assertEqual(0, ret['returncode'])
+        time.sleep(2)
+        self.assertTrue(os.path.exists(marker))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+
+from synapse import codec
+from synapse.task import IncomingMessage, OutgoingMessage, AmqpTask
+
+
+class TestMessages(unittest.TestCase):
+
+    def test_incoming_defaults(self):
+        msg = IncomingMessage('{"collection": "files", "action": "read"}')
+        self.assertEqual('files', msg.collection)
+        self.assertEqual('read', msg.action)
+        self.assertEqual({}, msg.body['attributes'])
+        self.assertEqual(False, msg.body['monitor'])
+
+    def test_invalid_incoming(self):
+        for body in ('{"collection": "files"}', '[1, 2]', '{"collection"',
+                     '{"collection": "files", "action": "read", '
+                     '"attributes": []}'):
+            self.assertRaises(ValueError, IncomingMessage, body)
+
+    def test_outgoing_encoded_once(self):
+        task = AmqpTask(OutgoingMessage(collection='files', status={'a': 1}))
+        body = task.get()['body']
+        self.assertTrue(task.get()['body'] is body)
+        self.assertEqual({'a': 1}, codec.decode(body)['status'])
+
+    def test_controller_response(self):
+        task = AmqpTask({'error': 'Filters did not match'})
+        publish_args = task.get()
+        self.assertEqual(codec.JSON, publish_args['properties'].content_type)
+        self.assertEqual({'error': 'Filters did not match'},
+                         codec.decode(publish_args['body']))
+
+    def test_unencodable_body(self):
+        task = AmqpTask(OutgoingMessage(status=object()))
+        self.assertRaises(ValueError, task.get)
+
+    def test_unknown_content_type_is_json(self):
+        msg = IncomingMessage('{"collection": "files", "action": "read"}',
+                              content_type='text/plain; charset=utf-8')
+        self.assertEqual('files', msg.collection)
+
+    @unittest.skipIf(codec.msgpack is None, "msgpack is not installed")
+    def test_msgpack_reply(self):
+        body = codec.encode({'collection': 'files', 'action': 'read'},
+                            codec.MSGPACK)
+        msg = IncomingMessage(body, content_type=codec.MSGPACK)
+        self.assertEqual('read', msg.action)
+
+        task = AmqpTask(OutgoingMessage(status={'a': 1}),
+                        headers={'content_type': codec.MSGPACK})
+        publish_args = task.get()
+        self.assertEqual(codec.MSGPACK,
+                         publish_args['properties'].content_type)
+        body = codec.decode(publish_args['body'], codec.MSGPACK)
+        self.assertEqual({u'a': 1}, body[u'status'])
+        for key in body:
+            self.assertTrue(isinstance(key, unicode))
+        self.assertTrue(isinstance(body[u'version'], unicode))
+
+
+if __name__ == '__main__':
+    unittest.main()
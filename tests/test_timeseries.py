@@ -0,0 +1,49 @@
+import unittest
+
+from synapse.timeseries import Series, TimeSeriesStore
+
+
+class TestTimeSeries(unittest.TestCase):
+
+    def test_aggregate_window(self):
+        series = Series()
+        for second in range(100):
+            series.add(second, 1000 + second)
+
+        result = series.aggregate(10, now=1099)
+        self.assertEqual(90, result['min'])
+        self.assertEqual(99, result['max'])
+        self.assertEqual(94.5, result['avg'])
+        self.assertEqual(10, result['count'])
+
+    def test_coarser_resolution_for_long_windows(self):
+        series = Series()
+        for minute in range(120):
+            series.add(minute, minute * 60)
+
+        # Seconds are only kept for 10 minutes
+        result = series.aggregate(3600, now=119 * 60)
+        self.assertEqual(60, result['min'])
+        self.assertEqual(119, result['max'])
+        self.assertEqual(60, result['count'])
+
+    def test_old_values_are_overwritten(self):
+        series = Series(resolutions=((1, 10),))
+        series.add(100, 0)
+        series.add(1, 10)
+
+        self.assertEqual(1, series.aggregate(10, now=10)['max'])
+        self.assertEqual(None, series.aggregate(5, now=30))
+
+    def test_store(self):
+        store = TimeSeriesStore()
+        store.add('cpu', '10', 1000)
+        store.add('cpu', 30, 1001)
+
+        self.assertEqual(20, store.aggregate('cpu', 60, now=1001)['avg'])
+        self.assertEqual(None, store.aggregate('load', 60))
+        self.assertEqual(['cpu'], store.names())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import select
+import unittest
+
+from synapse.wakeup import Wakeup
+
+
+class TestWakeup(unittest.TestCase):
+
+    def setUp(self):
+        self.wakeup = Wakeup()
+
+    def tearDown(self):
+        self.wakeup.close()
+
+    def _readable(self):
+        return bool(select.select([self.wakeup], [], [], 0)[0])
+
+    def test_notify_after_clear(self):
+        self.wakeup.notify()
+        self.wakeup.notify()
+        self.assertTrue(self._readable())
+        self.wakeup.clear()
+        self.assertFalse(self._readable())
+        self.wakeup.notify()
+        self.assertTrue(self._readable())
+
+    def test_notify_while_draining(self):
+        original_read = os.read
+
+        def _notify_then_read(fd, size):
+            # Notification sent by another thread while the pipe is drained
+            self.wakeup.notify()
+            return original_read(fd, size)
+
+        self.wakeup.notify()
+        os.read = _notify_then_read
+        try:
+            self.wakeup.clear()
+        finally:
+            os.read = original_read
+
+        self.wakeup.notify()
+        self.assertTrue(self._readable())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import os
+import imp
+import unittest
+
+from synapse.synapse_exceptions import ResourceException
+
+yum = imp.load_source('yum_pkg', os.path.join(
+    os.path.dirname(__file__), '..', 'synapse', 'resources',
+    'packages-plugin', 'yum-pkg.py'))
+
+
+class TestYumUpdate(unittest.TestCase):
+
+    def setUp(self):
+        self.commands = []
+        self.installed = set(['httpd', 'vim'])
+
+        def _exec_cmd(cmd):
+            self.commands.append(cmd)
+            return {'returncode': 0, 'stdout': '', 'stderr': ''}
+
+        self._saved = yum.exec_cmd, yum.is_installed
+        yum.exec_cmd = _exec_cmd
+        yum.is_installed = lambda name: name in self.installed
+
+    def tearDown(self):
+        yum.exec_cmd, yum.is_installed = self._saved
+
+    def test_update_two_packages(self):
+        yum.update('httpd vim')
+        self.assertEqual(['/usr/bin/yum -q -y update httpd vim'],
+                         self.commands)
+
+    def test_update_only_installed_packages(self):
+        self.assertRaises(ResourceException, yum.update, ['httpd', 'nginx'])
+        self.assertEqual(['/usr/bin/yum -q -y update httpd'], self.commands)
+
+
+if __name__ == '__main__':
+    unittest.main()